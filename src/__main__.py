@@ -1,25 +1,53 @@
+import argparse
 import sys
 import threading
-from queue import SimpleQueue
 from PySide6.QtWidgets import QApplication, QFileDialog
 from background_segmenter import BackgroundSegmenter
+from frame_cache import shared_frame_cache
 from main_window import MainWindow
+from sam2_config import SAM2_MODELS, SAM2_OPTIMIZATIONS
+from segmentation_queue import SegmentationQueue
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sam2-model", choices=SAM2_MODELS, default="large")
+    parser.add_argument(
+        "--sam2-threads", type=int, default=None, help="torch intra-op threads"
+    )
+    parser.add_argument(
+        "--sam2-optimization", choices=SAM2_OPTIMIZATIONS, default="none"
+    )
+    parser.add_argument(
+        "--frame-cache-mb",
+        type=int,
+        default=1024,
+        help="memory for decoded video frames",
+    )
+    args, qt_args = parser.parse_known_args()
+    shared_frame_cache().set_max_bytes(args.frame_cache_mb * 1024**2)
+
     # Create the application instance
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
 
     videos_path = QFileDialog.getExistingDirectory(
         None, "Select the folder with videos"
     )
 
     # Create the work queue and main window
-    work_queue = SimpleQueue()
+    work_queue = SegmentationQueue()
     main_win = MainWindow(work_queue, videos_path)
 
     # Initialize and start the background segmenter thread
-    segmenter = BackgroundSegmenter(main_win, work_queue)
+    segmenter = BackgroundSegmenter(
+        main_win,
+        work_queue,
+        sam2_options={
+            "model": args.sam2_model,
+            "num_threads": args.sam2_threads,
+            "optimization": args.sam2_optimization,
+        },
+    )
     segmenter_thread = threading.Thread(target=segmenter.run, daemon=False)
     segmenter_thread.start()
 
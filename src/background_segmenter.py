@@ -1,73 +1,393 @@
-from queue import SimpleQueue
+from dataclasses import dataclass
+from queue import Empty
+from typing import Any, Iterator
 
 import numpy as np
-from PySide6.QtGui import QStatusTipEvent
-from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QObject, Signal
 
-from database import DatabaseFrame, Record, active_db
-from drawing import draw_clicks, update_frame_image
+from database import Database, DatabaseFrame, Record, active_db
+from drawing import draw_clicks, get_masked_image
+from embedding_cache import get_embedding_key
+from frame_cache import shared_frame_cache
 from main_window import MainWindow
-from sam2_processor import Sam2Processor
+from sam2_worker import Sam2Worker
+from segmentation_queue import SegmentationQueue
 
 
-class BackgroundSegmenter:
-    def __init__(self, window: MainWindow, work_queue: SimpleQueue) -> None:
+@dataclass
+class FrameOverlay:
+    # The masks of a frame blended over its image by the run() thread, it is
+    # only shown if the records still have these exact segmentations
+    frame_index: int
+    segmentations: list[np.ndarray]
+    image: np.ndarray
+
+
+@dataclass
+class SegmentedBatch:
+    # Masks of the records that were pending, at the revision they had
+    db: Database
+    frame_indices: list[int]
+    records: list[Record]
+    revisions: list[int]
+    results: list[tuple[np.ndarray, np.ndarray | None]]  # (mask, logits)
+    overlays: list[FrameOverlay]
+
+
+@dataclass
+class PropagatedFrame:
+    db: Database
+    frame_index: int
+    image: np.ndarray
+    masks: dict[str, np.ndarray]
+    source_frame: int
+    overlay: FrameOverlay | None
+
+
+@dataclass
+class Propagation:
+    # A propagation in progress, the worker pauses it between chunks
+    db: Database
+    frame_index: int
+    frame_count: int
+    received: int = 0
+
+
+def get_overlay(
+    frame_index: int, original_image: np.ndarray, segmentations: list[np.ndarray]
+) -> FrameOverlay:
+    # Blending a 1080p frame takes a few hundred ms, never on the GUI thread
+    return FrameOverlay(
+        frame_index, segmentations, get_masked_image(original_image, segmentations)
+    )
+
+
+def apply_overlay(frame: DatabaseFrame, overlay: FrameOverlay | None) -> bool:
+    # GUI thread. False if the records changed since the overlay was built,
+    # the frame is queued again then.
+    if overlay is None:
+        return False
+    segmentations = [record.segmentation for record in frame.records.values()]
+    if len(segmentations) != len(overlay.segmentations) or any(
+        a is not b for a, b in zip(segmentations, overlay.segmentations)
+    ):
+        return False
+    frame.segmented_image = overlay.image
+    draw_clicks(frame)
+    return True
+
+
+def get_propagated_overlay(
+    db: Database, frame_index: int, image: np.ndarray, masks: dict[str, np.ndarray]
+) -> FrameOverlay | None:
+    # The records the frame will have once the GUI thread added the propagated
+    # masks, see Database.add_derived_record. None if some still need a mask.
+    frame = db.frames.get(frame_index)
+    records = {} if frame is None else dict(frame.records)
+    segmentations = [
+        masks[name]
+        if name in masks and record.derived_from is not None
+        else record.segmentation
+        for name, record in records.items()
+    ]
+    segmentations += [mask for name, mask in masks.items() if name not in records]
+    if any(segmentation is None for segmentation in segmentations):
+        return None
+    original_image = image if frame is None else frame.original_image
+    return get_overlay(frame_index, original_image, segmentations)
+
+
+class BackgroundSegmenter(QObject):
+    # The run() thread hands the queued frames to the sam2 worker process and
+    # waits for it, the model never runs in the GUI process. Results reach
+    # the GUI thread through queued signals, which apply them to the database.
+    status_changed = Signal(str)
+    masks_ready = Signal(object)  # SegmentedBatch
+    frame_propagated = Signal(object)  # PropagatedFrame
+    propagation_finished = Signal()
+
+    def __init__(
+        self,
+        window: MainWindow,
+        work_queue: SegmentationQueue,
+        batch_size: int | None = None,
+        sam2_options: dict[str, Any] | None = None,
+    ) -> None:
+        super().__init__()
         self.should_stop = False
         self.window = window
 
-        self.run_with_sam = True
-        if self.run_with_sam:
-            self.sam2_ = Sam2Processor()
-        else:
-            self.sam2_ = None
+        # Sam2Processor arguments: model tier, threads, optimization
+        self.sam2_options_ = sam2_options or {}
+        # Started by the run() thread on the first request, it loads the model
+        self.worker_: Sam2Worker | None = None
+        self.status_ = ""
 
         self.work_queue_ = work_queue
+        # Frames segmented together, with one encoder pass. None picks a size
+        # once the model is loaded.
+        self.batch_size = batch_size
+        # Frames propagated between two checks for the frame on screen
+        self.propagation_chunk_size = 1
+        self.propagation_: Propagation | None = None
 
-    def run(self) -> None:
-        while not self.should_stop:
-            if QApplication.activeWindow() is not None:
-                if self.work_queue_.empty():
-                    QApplication.sendEvent(
-                        QApplication.activeWindow(), QStatusTipEvent("sam2:Ready")
-                    )
+        # Emitted from the run() thread, so these are queued connections
+        self.status_changed.connect(window.show_status)
+        self.masks_ready.connect(self.apply_masks)
+        self.frame_propagated.connect(self.add_propagated_frame)
+        self.propagation_finished.connect(window.side_menu.display_records)
+
+    def set_status(self, message: str) -> None:
+        if message != self.status_:
+            self.status_ = message
+            self.status_changed.emit(message)
+
+    def get_worker(self) -> Sam2Worker:
+        if self.worker_ is None:
+            self.worker_ = Sam2Worker(self.sam2_options_, self.set_status)
+        return self.worker_
 
+    def get_batch_size(self) -> int:
+        if self.batch_size is not None:
+            return self.batch_size
+        # Batches only pay off on a GPU, on a CPU they delay the result of the
+        # current frame
+        device_type = None if self.worker_ is None else self.worker_.device_type
+        return 4 if device_type == "cuda" else 1
+
+    def get_batch(self) -> list[int]:
+        # Waits for a frame, then takes whatever else is queued up to the batch
+        # size. The queue hands out the frame on screen first.
+        frame_indices: list[int] = [self.work_queue_.get(block=True, timeout=0.5)]
+        batch_size = self.get_batch_size()
+        while len(frame_indices) < batch_size:
+            # Not empty() then get(), clear() can run in between
             try:
-                frame_index: int = self.work_queue_.get(block=True, timeout=0.5)
-            except:
-                continue
+                frame_indices.append(self.work_queue_.get(block=False))
+            except Empty:
+                break
+        return frame_indices
 
-            frame = active_db().frames.get(frame_index)
+    def run(self) -> None:
+        try:
+            while not self.should_stop:
+                try:
+                    if self.work_queue_.take_cancel_propagation():
+                        # Another video was loaded
+                        self.cancel_propagation()
 
-            # Check that frame was not deleted
+                    if self.propagation_ is not None:
+                        # A click on the frame on screen is served between
+                        # two chunks
+                        if not self.work_queue_.has_current_frame():
+                            self.receive_propagated(
+                                self.get_worker().continue_propagation(
+                                    self.propagation_chunk_size
+                                )
+                            )
+                            continue
+                    else:
+                        propagation = self.work_queue_.get_propagation()
+                        if propagation is not None:
+                            self.propagate(*propagation)
+                            continue
+
+                    if self.work_queue_.empty():
+                        self.set_status("sam2:Ready")
+
+                    try:
+                        frame_indices = self.get_batch()
+                    except:
+                        continue
+                    self.segment_frames(frame_indices)
+                except RuntimeError as e:
+                    print(f"Segmentation failed: {e}")
+                    self.set_status("sam2:Segmentation failed")
+                    if self.propagation_ is not None:
+                        # The worker dropped it
+                        self.propagation_ = None
+                        self.propagation_finished.emit()
+                    if self.worker_ is not None and not self.worker_.is_alive():
+                        # Started again on the next request
+                        self.worker_ = None
+        finally:
+            if self.worker_ is not None:
+                self.worker_.stop()
+
+    def segment_frames(self, frame_indices: list[int]) -> None:
+        db = active_db()
+        # Check that frames were not deleted. The segmentations are read once,
+        # the GUI thread can change them meanwhile.
+        frames = []
+        for frame in map(db.frames.get, frame_indices):
             if frame is not None:
-                if QApplication.activeWindow() is not None:
-                    QApplication.sendEvent(
-                        QApplication.activeWindow(),
-                        QStatusTipEvent(
-                            f"sam2:Segmenting {self.work_queue_.qsize() + 1} frames..."
-                        ),
-                    )
-
-                # Do a slow segmentation
-                for record in frame.records.values():
-                    if record.segmentation is None:
-                        # Segment!
-                        self.segment_record(frame, record)
-
-                # Combine segmentations into a single image
-                update_frame_image(frame)
-
-            # Trigger UI update
+                frame_records = list(frame.records.values())
+                segmentations = [record.segmentation for record in frame_records]
+                frames.append((frame, frame_records, segmentations))
+        # Only frames with records to segment are sent
+        pending = []
+        for frame, frame_records, segmentations in frames:
+            records = [
+                record
+                for record, segmentation in zip(frame_records, segmentations)
+                if segmentation is None
+            ]
+            if records:
+                pending.append((frame, records))
+
+        # Points can change in the GUI thread while the model runs, a mask is
+        # only kept if its record is still at the revision it was computed for
+        records = [record for _, frame_records in pending for record in frame_records]
+        revisions = [record.revision for record in records]
+        masks = []
+        if pending:
+            self.set_status(
+                f"sam2:Segmenting {self.work_queue_.qsize() + len(pending)} frames..."
+            )
+            masks = self.get_worker().segment(
+                [frame.original_image for frame, _ in pending],
+                [
+                    [
+                        (
+                            record.positive_points,
+                            record.negative_points,
+                            record.mask_logits,
+                        )
+                        for record in frame_records
+                    ]
+                    for _, frame_records in pending
+                ],
+                [get_embedding_key(db.video_path, frame.frame) for frame, _ in pending],
+            )
+            masks = [
+                [
+                    (mask.astype(np.uint8, copy=False), logits)
+                    for mask, logits in frame_masks
+                ]
+                for frame_masks in masks
+            ]
+        results = [result for frame_masks in masks for result in frame_masks]
+
+        # Combine the segmentations into a single image per frame
+        masks_by_frame = {
+            frame.frame: iter(frame_masks)
+            for (frame, _), frame_masks in zip(pending, masks)
+        }
+        overlays = []
+        for frame, _, segmentations in frames:
+            frame_masks = masks_by_frame.get(frame.frame, iter([]))
+            segmentations = [
+                next(frame_masks)[0] if segmentation is None else segmentation
+                for segmentation in segmentations
+            ]
+            overlays.append(
+                get_overlay(frame.frame, frame.original_image, segmentations)
+            )
+
+        self.masks_ready.emit(
+            SegmentedBatch(db, frame_indices, records, revisions, results, overlays)
+        )
+
+    def apply_masks(self, batch: SegmentedBatch) -> None:
+        # GUI thread, only swaps in the results
+        for record, revision, (mask, mask_logits) in zip(
+            batch.records, batch.revisions, batch.results
+        ):
+            if record.revision == revision:
+                record.segmentation = mask
+                record.mask_logits = mask_logits
+        if batch.db is not active_db():
+            # Another video was loaded meanwhile
+            return
+
+        # A frame edited meanwhile is queued again and is combined after that
+        # pass
+        for overlay in batch.overlays:
+            frame = batch.db.frames.get(overlay.frame_index)
+            if frame is not None:
+                apply_overlay(frame, overlay)
+        for frame_index in batch.frame_indices:
             self.window.update_ui(frame_index)
 
-    def segment_record(self, frame: DatabaseFrame, record: Record) -> None:
-        if self.sam2_:
-            mask = self.sam2_.process_click(
-                frame.original_image, record.positive_points, record.negative_points
+    def propagate(self, frame_index: int, frame_count: int) -> None:
+        # Tracks the annotated records of the frame over frame_count frames in
+        # each direction and stores the masks as derived records
+        db = active_db()
+        frame = db.frames.get(frame_index)
+        if frame is None:
+            return
+        prompts = {
+            record.name: (record.positive_points, record.negative_points)
+            for record in frame.records.values()
+            if record.derived_from is None
+        }
+        if not prompts:
+            return
+
+        self.propagation_ = Propagation(db, frame_index, frame_count)
+        self.receive_propagated(
+            self.get_worker().propagate(
+                db.video_path,
+                frame_index,
+                prompts,
+                frame_count,
+                self.propagation_chunk_size,
+            )
+        )
+
+    def receive_propagated(
+        self, frames: Iterator[tuple[int, np.ndarray, dict[str, np.ndarray]]]
+    ) -> None:
+        # One chunk of the propagation in progress
+        propagation = self.propagation_
+        assert propagation is not None
+        db = propagation.db
+        for index, image, masks in frames:
+            propagation.received += 1
+            self.set_status(
+                f"sam2:Propagating {propagation.received}/"
+                f"{2 * propagation.frame_count} frames..."
             )
-            mask = mask.astype(np.uint8)
-        else:
-            mask = np.full(
-                (frame.original_image.shape[0], frame.original_image.shape[1]), 0
+            self.frame_propagated.emit(
+                PropagatedFrame(
+                    db,
+                    index,
+                    image,
+                    masks,
+                    propagation.frame_index,
+                    get_propagated_overlay(db, index, image, masks),
+                )
             )
-        record.segmentation = mask
+        if not self.get_worker().propagating:
+            self.propagation_ = None
+            self.propagation_finished.emit()
+
+    def cancel_propagation(self) -> None:
+        if self.propagation_ is None:
+            return
+        if self.worker_ is not None:
+            self.worker_.cancel_propagation()
+        self.propagation_ = None
+        self.propagation_finished.emit()
+
+    def add_propagated_frame(self, propagated: PropagatedFrame) -> None:
+        # GUI thread
+        db = propagated.db
+        if db is not active_db():
+            return
+        # The viewer may hold this frame already, keep one copy of it
+        frame_cache = shared_frame_cache()
+        image = frame_cache.get(db.video_path, propagated.frame_index)
+        if image is None:
+            image = propagated.image
+            frame_cache.put(db.video_path, propagated.frame_index, image)
+        for name, mask in propagated.masks.items():
+            db.add_derived_record(
+                propagated.frame_index, name, mask, propagated.source_frame, image
+            )
+
+        frame = db.frames[propagated.frame_index]
+        if not apply_overlay(frame, propagated.overlay):
+            # Annotated records of this frame still need their masks
+            self.work_queue_.put(propagated.frame_index)
+        self.window.update_ui(propagated.frame_index)
@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+
+from database import DatabaseFrame, Record
+from drawing import draw_clicks, update_frame_image
+from sam2_config import SAM2_MODELS, SAM2_OPTIMIZATIONS
+from video_source import open_video_source
+
+# Latency of each stage of the segmentation pipeline, headless: the SAM2 click
+# split into image encoding and mask decoding, the mask overlay, the click
+# markers, ImageLabel.set_image and painting the frame into the widget at its
+# display size. Results can be written
+# to JSON and compared with the results of another commit.
+# Usage: python benchmark_pipeline.py [--video video.mp4] [--model stand-in]
+#        [--records 2] [--runs 20] [--output new.json] [--compare old.json]
+
+
+@dataclass
+class StandInPrompt:
+    # Like sam2_processor.Prompt, which needs torch
+    positive: np.ndarray
+    negative: np.ndarray
+    mask_logits: np.ndarray | None = None
+
+
+class StandInProcessor:
+    # Same interface as Sam2Processor without torch or a checkpoint, its encode
+    # and decode times say nothing about SAM2 but the other stages can run.
+    # The mask is a disc around the positive points.
+    def get_embeddings(
+        self, images: list[np.ndarray], image_keys: list[Any]
+    ) -> list[tuple[np.ndarray, tuple[int, int]]]:
+        return [
+            (
+                cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA).astype(
+                    np.float32
+                ),
+                image.shape[:2],
+            )
+            for image in images
+        ]
+
+    def predict_masks(
+        self, embedding: tuple[np.ndarray, tuple[int, int]], prompts: list[StandInPrompt]
+    ) -> list[tuple[np.ndarray, None]]:
+        image_shape = embedding[1]
+        results = []
+        for prompt in prompts:
+            mask = np.zeros(image_shape, dtype=np.uint8)
+            for x, y in prompt.positive.astype(np.int32):
+                cv2.circle(mask, (int(x), int(y)), min(image_shape) // 8, 1, -1)
+            results.append((mask, None))
+        return results
+
+
+def get_frames(
+    video_path: Path | None, frame_count: int, width: int, height: int
+) -> list[np.ndarray]:
+    if video_path is None:
+        # Smooth shapes on a gradient, a different offset per frame
+        y, x = np.mgrid[0:height, 0:width]
+        frames = []
+        for i in range(frame_count):
+            image = np.stack([(x + i) % 256, y % 256, (x + y) % 256], axis=2)
+            image[height // 3 : height // 2, width // 3 + i : width // 2 + i] = (
+                40,
+                90,
+                160,
+            )
+            frames.append(image.astype(np.uint8))
+        return frames
+
+    # Evenly spaced recorded frames
+    video_source = open_video_source(video_path)
+    indices = np.linspace(0, video_source.frame_count - 1, frame_count).astype(int)
+    frames = [frame for _, frame in video_source.read_batch(indices.tolist())]
+    video_source.release()
+    assert all(frame is not None for frame in frames), f"Cannot read {str(video_path)}"
+    return frames
+
+
+def get_points(image: np.ndarray, record_count: int) -> list[np.ndarray]:
+    # One positive point per record, spread over the width of the image
+    height, width = image.shape[:2]
+    return [
+        np.array([[width * (i + 1) / (record_count + 1), height / 2]])
+        for i in range(record_count)
+    ]
+
+
+def get_stats(times: list[float]) -> dict[str, float]:
+    times_ms = np.array(times) * 1000
+    return {
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "mean_ms": float(times_ms.mean()),
+        "per_second": float(1000 / times_ms.mean()),
+        "runs": len(times),
+    }
+
+
+def time_stage(
+    run: Callable[[int], None], frame_count: int, runs: int
+) -> dict[str, float]:
+    # run(i) processes frame i % frame_count, the first pass is a warm up
+    run(0)
+    times = []
+    for i in range(runs):
+        start_time = time.perf_counter()
+        run(i % frame_count)
+        times.append(time.perf_counter() - start_time)
+    return get_stats(times)
+
+
+def get_processor(
+    model: str, num_threads: int | None, optimization: str, random_weights: bool
+) -> tuple[Any, type]:
+    # The processor and its prompt class
+    if model == "stand-in":
+        return StandInProcessor(), StandInPrompt
+
+    # Imported here, the stand-in runs without torch
+    from sam2_config import SAM2_CHECKPOINT_DIR
+    from sam2_processor import Prompt, Sam2Processor
+
+    checkpoint_path = SAM2_CHECKPOINT_DIR / SAM2_MODELS[model][1]
+    if not random_weights and not checkpoint_path.exists():
+        raise SystemExit(
+            f"{str(checkpoint_path)} not found, use --random-weights or --model stand-in"
+        )
+    processor = Sam2Processor(
+        model,
+        num_threads=num_threads,
+        optimization=optimization,
+        checkpoint_dir=None if random_weights else SAM2_CHECKPOINT_DIR,
+        use_embedding_store=False,
+    )
+    return processor, Prompt
+
+
+def benchmark(
+    frames: list[np.ndarray],
+    processor: Any,
+    prompt_type: type,
+    record_count: int,
+    runs: int,
+    sam2_runs: int,
+) -> dict[str, dict[str, float]]:
+    def predict(embedding: Any, image: np.ndarray) -> list[tuple[np.ndarray, Any]]:
+        prompts = [
+            prompt_type(points, np.zeros((0, 2)))
+            for points in get_points(image, record_count)
+        ]
+        return processor.predict_masks(embedding, prompts)
+
+    results = {}
+
+    # Encode without a cache key, so every pass runs the image encoder
+    embeddings = [processor.get_embeddings([image], [None])[0] for image in frames]
+    results["sam2 encode"] = time_stage(
+        lambda i: processor.get_embeddings([frames[i]], [None]),
+        len(frames),
+        sam2_runs,
+    )
+    results["sam2 decode"] = time_stage(
+        lambda i: predict(embeddings[i], frames[i]), len(frames), runs
+    )
+
+    # Annotated frames with the masks of the model, like after segmentation
+    db_frames = []
+    for i, (image, embedding) in enumerate(zip(frames, embeddings)):
+        db_frame = DatabaseFrame(frame=i, original_image=image)
+        points = get_points(image, record_count)
+        for j, (mask, _) in enumerate(predict(embedding, image)):
+            db_frame.records[f"object {j}"] = Record(
+                frame=i,
+                name=f"object {j}",
+                positive_points=points[j],
+                negative_points=np.zeros((0, 2)),
+                segmentation=mask.astype(np.uint8),
+            )
+        db_frames.append(db_frame)
+
+    def draw(i: int) -> None:
+        # From the original image, as the first click on a frame does
+        db_frames[i].segmented_image = None
+        draw_clicks(db_frames[i])
+
+    results["update_frame_image"] = time_stage(
+        lambda i: update_frame_image(db_frames[i]), len(frames), runs
+    )
+    results["draw_clicks"] = time_stage(draw, len(frames), runs)
+
+    # The application must outlive the label
+    application, image_label = get_image_label()
+    if image_label is None:
+        print("PySide6 not installed, ImageLabel.set_image skipped")
+    else:
+        from PySide6.QtGui import QImage
+
+        segmented = [db_frame.segmented_image for db_frame in db_frames]
+        results["ImageLabel.set_image"] = time_stage(
+            lambda i: image_label.set_image(segmented[i]), len(frames), runs
+        )
+        # The frame scaled into the widget, as shown on screen
+        target = QImage(image_label.size(), QImage.Format.Format_RGB32)
+
+        def paint(i: int) -> None:
+            image_label.set_image(segmented[i])
+            image_label.render(target)
+
+        results["ImageLabel paint"] = time_stage(paint, len(frames), runs)
+    return results
+
+
+def get_image_label() -> tuple[Any, Any]:
+    # (QApplication, ImageLabel), (None, None) without PySide6
+    try:
+        from PySide6.QtWidgets import QApplication
+    except ImportError:
+        return None, None
+
+    # No window is shown, the offscreen platform works without a display
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    application = QApplication.instance() or QApplication([])
+
+    from image_label import ImageLabel
+
+    image_label = ImageLabel()
+    image_label.resize(1280, 720)
+    return application, image_label
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]] | None,
+) -> None:
+    for stage, stats in results.items():
+        line = (
+            f"{stage:>20}: p50 {stats['p50_ms']:9.2f} ms, "
+            f"p95 {stats['p95_ms']:9.2f} ms, {stats['per_second']:8.1f} /s"
+        )
+        if baseline is not None and stage in baseline:
+            # Above 1 is slower than the baseline
+            ratio = stats["p50_ms"] / baseline[stage]["p50_ms"]
+            line += f", p50 x{ratio:.2f} of baseline"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", type=Path, default=None)
+    parser.add_argument(
+        "--size",
+        type=int,
+        nargs=2,
+        default=[1920, 1080],
+        help="width height of synthetic frames, 3840 2160 for 4K",
+    )
+    parser.add_argument("--frames", type=int, default=4)
+    parser.add_argument("--records", type=int, default=2)
+    parser.add_argument(
+        "--model",
+        choices=["stand-in", *SAM2_MODELS],
+        default="stand-in",
+        help="stand-in runs without torch, its sam2 times are meaningless",
+    )
+    parser.add_argument("--optimization", choices=SAM2_OPTIMIZATIONS, default="none")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="SAM2 without a checkpoint, masks are meaningless",
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--sam2-runs", type=int, default=3, help="runs of the image encoder"
+    )
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    args = parser.parse_args()
+
+    frames = get_frames(args.video, args.frames, *args.size)
+    processor, prompt_type = get_processor(
+        args.model, args.threads, args.optimization, args.random_weights
+    )
+    results = benchmark(
+        frames, processor, prompt_type, args.records, args.runs, args.sam2_runs
+    )
+
+    baseline = None
+    if args.compare is not None:
+        with args.compare.open("r") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with args.output.open("w") as f:
+            json.dump(
+                {
+                    "commit": get_commit(),
+                    "machine": {
+                        "platform": platform.platform(),
+                        "processor": platform.processor(),
+                        "cpu_count": os.cpu_count(),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                    },
+                    "options": {
+                        "video": None if args.video is None else str(args.video),
+                        "size": list(frames[0].shape[1::-1]),
+                        "frames": args.frames,
+                        "records": args.records,
+                        "model": args.model,
+                        "optimization": args.optimization,
+                        "threads": args.threads,
+                        "random_weights": args.random_weights,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results written to {str(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
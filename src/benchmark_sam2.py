@@ -0,0 +1,138 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from sam2_config import SAM2_CHECKPOINT_DIR, SAM2_MODELS, SAM2_OPTIMIZATIONS
+from sam2_processor import Prompt, Sam2Processor
+from video_source import open_video_source
+
+# Image encoder and mask decoder latency of each model tier on one reference
+# frame, and how close each mask is to the one of the largest tier.
+# Usage: python benchmark_sam2.py [--video video.mp4 --frame 0] [--models tiny large]
+#        [--optimizations none quantize] [--threads 4] [--random-weights]
+
+
+def get_reference_frame(video_path: Path | None, frame_index: int) -> np.ndarray:
+    if video_path is None:
+        # Smooth shapes on a gradient, 1080p like the camera footage
+        y, x = np.mgrid[0:1080, 0:1920]
+        image = np.stack([x % 256, y % 256, (x + y) % 256], axis=2)
+        image[300:700, 800:1200] = (40, 90, 160)
+        return image.astype(np.uint8)
+
+    video_source = open_video_source(video_path)
+    frame = video_source.read(frame_index)
+    video_source.release()
+    assert frame is not None, f"Cannot read frame {frame_index} of {str(video_path)}"
+    return frame
+
+
+def get_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union > 0 else 1.0
+
+
+def benchmark(
+    image: np.ndarray,
+    point: np.ndarray,
+    models: list[str],
+    optimizations: list[str],
+    num_threads: int | None,
+    random_weights: bool,
+    runs: int,
+) -> None:
+    prompts = [Prompt(point, np.zeros((0, 2)))]
+    masks = {}
+    for model in models:
+        checkpoint_path = SAM2_CHECKPOINT_DIR / SAM2_MODELS[model][1]
+        if not random_weights and not checkpoint_path.exists():
+            print(f"{model}: {str(checkpoint_path)} not found, skipped")
+            continue
+
+        for optimization in optimizations:
+            start_time = time.perf_counter()
+            processor = Sam2Processor(
+                model,
+                num_threads=num_threads,
+                optimization=optimization,
+                checkpoint_dir=None if random_weights else SAM2_CHECKPOINT_DIR,
+                use_embedding_store=False,
+            )
+            load_time = time.perf_counter() - start_time
+
+            # The first pass is a warm up, torch.compile compiles during it
+            embedding = processor.get_embeddings([image], [None])[0]
+            encode_times = []
+            decode_times = []
+            for _ in range(runs):
+                start_time = time.perf_counter()
+                embedding = processor.get_embeddings([image], [None])[0]
+                encode_times.append(time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                mask = processor.predict_masks(embedding, prompts)[0][0]
+                decode_times.append(time.perf_counter() - start_time)
+            masks[(model, optimization)] = mask
+
+            print(
+                f"{model:>6} {optimization:>9}: load {load_time:6.2f} s, "
+                f"encode {np.median(encode_times) * 1000:8.1f} ms, "
+                f"decode {np.median(decode_times) * 1000:7.1f} ms"
+            )
+
+    if not masks or random_weights:
+        return
+
+    # Quality relative to the largest tier without optimization
+    reference_key = max(
+        masks, key=lambda k: (list(SAM2_MODELS).index(k[0]), k[1] == "none")
+    )
+    print(f"Mask IoU against {reference_key[0]} {reference_key[1]}:")
+    for (model, optimization), mask in masks.items():
+        print(
+            f"{model:>6} {optimization:>9}: {get_iou(mask, masks[reference_key]):.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", type=Path, default=None)
+    parser.add_argument("--frame", type=int, default=0)
+    parser.add_argument(
+        "--point", type=float, nargs=2, default=None, help="x y, the centre if unset"
+    )
+    parser.add_argument(
+        "--models", nargs="+", choices=SAM2_MODELS, default=list(SAM2_MODELS)
+    )
+    parser.add_argument(
+        "--optimizations", nargs="+", choices=SAM2_OPTIMIZATIONS, default=["none"]
+    )
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="time the models without checkpoints, masks are meaningless",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    image = get_reference_frame(args.video, args.frame)
+    if args.point is None:
+        point = np.array([[image.shape[1] / 2, image.shape[0] / 2]])
+    else:
+        point = np.array([args.point])
+    benchmark(
+        image,
+        point,
+        args.models,
+        args.optimizations,
+        args.threads,
+        args.random_weights,
+        args.runs,
+    )
+
+
+if __name__ == "__main__":
+    main()
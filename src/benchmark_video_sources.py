@@ -0,0 +1,69 @@
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from video_source import VIDEO_BACKENDS, open_video_source
+
+# Compares the video backends on the access patterns used by the app: random
+# frames (annotations, scrubbing) and a fixed stride (motion detection).
+# Usage: python benchmark_video_sources.py video.mp4 [sample_count] [stride]
+
+
+def get_access_patterns(
+    frame_count: int, sample_count: int, stride: int
+) -> dict[str, list[int]]:
+    rng = np.random.default_rng(0)
+    return {
+        "random": rng.integers(0, frame_count, sample_count).tolist(),
+        "random sorted": np.sort(rng.integers(0, frame_count, sample_count)).tolist(),
+        f"stride {stride}": list(range(0, frame_count, stride))[:sample_count],
+    }
+
+
+def benchmark(video_path: Path, sample_count=100, stride=90) -> None:
+    for backend in VIDEO_BACKENDS:
+        try:
+            video_source = open_video_source(video_path, backend)
+        except ImportError:
+            print(f"{backend}: not installed, skipped")
+            continue
+        patterns = get_access_patterns(video_source.frame_count, sample_count, stride)
+        video_source.release()
+
+        decode_modes = ["seek", "sequential"] if backend == "opencv" else ["batch"]
+        for pattern_name, indices in patterns.items():
+            for decode_mode in decode_modes:
+                # A fresh source per run so no decoder state is shared
+                video_source = open_video_source(video_path, backend)
+                start_time = time.perf_counter()
+                failed = sum(
+                    frame is None
+                    for _, frame in video_source.read_batch(indices, decode_mode)
+                )
+                elapsed = time.perf_counter() - start_time
+                print(
+                    f"{backend:>7} {decode_mode:>10} {pattern_name:>14}: "
+                    f"{len(indices) / elapsed:8.1f} frames/s, "
+                    f"{video_source.decoded_frames / elapsed:8.1f} decoded fps, "
+                    f"{failed} failed"
+                )
+                video_source.release()
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(
+            "Usage: python benchmark_video_sources.py video.mp4 [sample_count] [stride]"
+        )
+        return
+
+    video_path = Path(sys.argv[1])
+    sample_count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    stride = int(sys.argv[3]) if len(sys.argv) > 3 else 90
+    benchmark(video_path, sample_count, stride)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from motion_detector import MOTION_METRICS, detect_motion
+
+# Runs every motion metric on the same videos and checks that they produce the
+# same motion periods as the contour metric.
+# Usage: python compare_motion_metrics.py [video.mp4 ...] (defaults to data/*.mp4)
+
+
+def boundary_differences(
+    reference: list[dict[str, Any]], other: list[dict[str, Any]]
+) -> list[int]:
+    # Frame differences between the boundaries of periods at the same position
+    return [
+        abs(a[key] - b[key])
+        for a, b in zip(reference, other)
+        for key in ("start_frames", "end_frames")
+    ]
+
+
+def compare_video(video_path: Path, step_sec=3) -> bool:
+    results = {}
+    for motion_metric in MOTION_METRICS:
+        start_time = time.perf_counter()
+        results[motion_metric] = detect_motion(
+            video_path,
+            step_sec=step_sec,
+            motion_metric=motion_metric,
+            save_output=False,
+        )
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"  {motion_metric:>10}: {len(results[motion_metric] or [])} periods in {elapsed:.2f}s"
+        )
+
+    reference = results["contours"]
+    all_match = True
+    for motion_metric, motion_periods in results.items():
+        if motion_metric == "contours":
+            continue
+        match = motion_periods == reference
+        all_match = all_match and match
+        if match:
+            print(f"  {motion_metric}: identical periods")
+        else:
+            differences = boundary_differences(reference or [], motion_periods or [])
+            print(
+                f"  {motion_metric}: DIFFERENT, {len(reference or [])} vs {len(motion_periods or [])} periods, "
+                f"largest boundary difference {max(differences, default=0)} frames"
+            )
+    return all_match
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.WARNING)
+
+    if len(sys.argv) > 1:
+        video_files = [Path(arg) for arg in sys.argv[1:]]
+    else:
+        video_files = list(Path("data").glob("*.mp4"))
+
+    if len(video_files) == 0:
+        print("No Videos found!")
+        return
+
+    mismatches = 0
+    for video_file in video_files:
+        print(video_file.name)
+        if not compare_video(video_file):
+            mismatches += 1
+
+    print(f"{len(video_files) - mismatches}/{len(video_files)} videos match")
+
+
+if __name__ == "__main__":
+    main()
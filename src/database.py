@@ -11,6 +11,13 @@ class Record:
     negative_points: np.ndarray  # [point, coords]
 
     segmentation: np.ndarray | None = None  # [H,W]
+    # [256,256] low resolution logits of the last mask, fed back to SAM2 when
+    # the points change
+    mask_logits: np.ndarray | None = None
+    revision: int = 0  # Incremented on every change of the points
+    # Frame the mask was propagated from, None for records annotated with
+    # points. Derived records have no points and are not saved.
+    derived_from: int | None = None
 
 
 @dataclass
@@ -49,7 +56,8 @@ class Database:
             self.frames[frame] = frame_data
 
         record = frame_data.records.get(name)
-        if record is None:
+        if record is None or record.derived_from is not None:
+            # Clicking on a propagated mask starts a regular record
             record = Record(
                 frame=frame,
                 name=name,
@@ -70,6 +78,8 @@ class Database:
                 break
 
         if point_cancelled:
+            # The previous mask was shaped by the removed point, start over
+            record.mask_logits = None
             if is_positive:
                 record.negative_points = other_points
             else:
@@ -82,6 +92,34 @@ class Database:
                 record.negative_points = np.concatenate([record.negative_points, point])
         # Mask needs recalculating
         record.segmentation = None
+        record.revision += 1
+
+    def add_derived_record(
+        self,
+        frame: int,
+        name: str,
+        segmentation: np.ndarray,
+        source_frame: int,
+        original_image: np.ndarray,
+    ) -> bool:
+        # Returns False if the frame already has an annotated record of that name
+        frame_data = self.frames.get(frame)
+        if frame_data is None:
+            frame_data = DatabaseFrame(frame=frame, original_image=original_image)
+            self.frames[frame] = frame_data
+
+        record = frame_data.records.get(name)
+        if record is not None and record.derived_from is None:
+            return False
+        frame_data.records[name] = Record(
+            frame=frame,
+            name=name,
+            positive_points=np.ndarray((0, 2)),
+            negative_points=np.ndarray((0, 2)),
+            segmentation=segmentation,
+            derived_from=source_frame,
+        )
+        return True
 
 
 _database = Database(video_path=Path())
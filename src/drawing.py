@@ -40,19 +40,26 @@ def draw_clicks(frame: DatabaseFrame) -> None:
     frame.segmented_image = image
 
 
-def update_frame_image(frame: DatabaseFrame) -> None:
-
+def get_masked_image(
+    original_image: np.ndarray, segmentations: list[np.ndarray]
+) -> np.ndarray:
+    # The masks blended over the darkened image, in record order. Pure, so it
+    # can run off the GUI thread.
     base_alpha = 0.4
-    masked_image = frame.original_image.astype(dtype=np.float32, copy=True)
+    masked_image = original_image.astype(dtype=np.float32, copy=True)
     masked_image *= 0.8
-    for i, record in enumerate(frame.records.values()):
-        assert record.segmentation is not None
-        mask = record.segmentation
+    for i, mask in enumerate(segmentations):
         alpha_mask = base_alpha * mask[:, :, np.newaxis]
         color_mask = MASK_COLORS[i].reshape(1, 1, 3) * mask[:, :, np.newaxis]
         masked_image = masked_image * (1 - alpha_mask) + alpha_mask * color_mask
-    masked_image = masked_image.astype(np.uint8)
+    return masked_image.astype(np.uint8)
 
-    frame.segmented_image = masked_image
+
+def update_frame_image(frame: DatabaseFrame) -> None:
+    segmentations = []
+    for record in frame.records.values():
+        assert record.segmentation is not None
+        segmentations.append(record.segmentation)
+    frame.segmented_image = get_masked_image(frame.original_image, segmentations)
 
     draw_clicks(frame)
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Hashable
+
+
+@dataclass
+class ImageEmbedding:
+    # What SAM2ImagePredictor.set_image leaves in the predictor for one image
+    features: dict[str, Any]  # {"image_embed": tensor, "high_res_feats": [tensor]}
+    orig_hw: tuple[int, int]
+
+    @property
+    def nbytes(self) -> int:
+        tensors = [self.features["image_embed"]] + list(
+            self.features["high_res_feats"]
+        )
+        return sum(t.element_size() * t.nelement() for t in tensors)
+
+
+def get_predictor_embedding(predictor, index: int = 0) -> ImageEmbedding:
+    # Features of one image of the image set last in the predictor
+    features = predictor._features
+    if len(predictor._orig_hw) == 1:
+        return ImageEmbedding(features=features, orig_hw=tuple(predictor._orig_hw[0]))
+
+    # Copy out of a batch, a view would keep the whole batch alive
+    return ImageEmbedding(
+        features={
+            "image_embed": features["image_embed"][index : index + 1].clone(),
+            "high_res_feats": [
+                feat[index : index + 1].clone() for feat in features["high_res_feats"]
+            ],
+        },
+        orig_hw=tuple(predictor._orig_hw[index]),
+    )
+
+
+def set_predictor_embedding(predictor, embedding: ImageEmbedding) -> None:
+    # Equivalent to predictor.set_image() on the embedded image, without the
+    # image encoder pass
+    predictor.reset_predictor()
+    predictor._features = embedding.features
+    predictor._orig_hw = [embedding.orig_hw]
+    predictor._is_image_set = True
+
+
+class EmbeddingCache:
+    # Least recently used image embeddings, bounded by their size in bytes.
+    # Only the prompt encoder and mask decoder run again on a hit.
+    def __init__(self, max_bytes: int = 1024**3) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries_: OrderedDict[Hashable, ImageEmbedding] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries_)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries_
+
+    def get(self, key: Hashable) -> ImageEmbedding | None:
+        embedding = self.entries_.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.entries_.move_to_end(key)
+        self.hits += 1
+        return embedding
+
+    def put(self, key: Hashable, embedding: ImageEmbedding) -> None:
+        self.discard(key)
+        if embedding.nbytes > self.max_bytes:
+            return
+        self.entries_[key] = embedding
+        self.nbytes += embedding.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries_.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def discard(self, key: Hashable) -> None:
+        embedding = self.entries_.pop(key, None)
+        if embedding is not None:
+            self.nbytes -= embedding.nbytes
+
+    def clear(self) -> None:
+        self.entries_.clear()
+        self.nbytes = 0
+
+
+def get_embedding_key(video_path: Path, frame_index: int) -> tuple[str, int]:
+    return str(video_path), frame_index
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+
+from embedding_cache import ImageEmbedding
+
+# Features are stored as float16, half the size of the encoder output. The
+# masks decoded from them differ from the float32 ones by a few edge pixels.
+STORE_DTYPE = np.float16
+
+
+def get_embedding_store_path(video_path: Path) -> Path:
+    # Next to the _points.json file of the video
+    return video_path.parent / (video_path.with_suffix("").name + "_embeddings")
+
+
+def get_video_hash(video_path: Path, chunk_size: int = 1024**2) -> str:
+    # The size and the first and last MiB identify a video without reading it all
+    digest = hashlib.sha1()
+    size = video_path.stat().st_size
+    digest.update(str(size).encode())
+    with video_path.open("rb") as f:
+        digest.update(f.read(chunk_size))
+        f.seek(max(size - chunk_size, 0))
+        digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def get_model_key(
+    model_cfg: str, checkpoint_path: Path, optimization: str = "none"
+) -> dict[str, Any]:
+    # A different config, checkpoint file or quantization produces different
+    # features
+    key: dict[str, Any] = {
+        "model_cfg": model_cfg,
+        "checkpoint": checkpoint_path.name,
+        "optimization": optimization,
+    }
+    if checkpoint_path.exists():
+        stat = checkpoint_path.stat()
+        key["checkpoint_size"] = stat.st_size
+        key["checkpoint_mtime_ns"] = stat.st_mtime_ns
+    return key
+
+
+class EmbeddingStore:
+    # SAM2 image features of the frames of one video, one .npy file per frame.
+    # The files are memory mapped on load. key.json records the video and model
+    # the features were computed with, the store is emptied if they change.
+    def __init__(self, video_path: Path, model_key: dict[str, Any]) -> None:
+        self.video_path = video_path
+        self.path = get_embedding_store_path(video_path)
+        self.key = json.loads(
+            json.dumps({"video_hash": get_video_hash(video_path), "model": model_key})
+        )
+
+        key_path = self.path / "key.json"
+        if key_path.exists():
+            with key_path.open("r") as f:
+                if json.load(f) != self.key:
+                    print(f"Clearing {str(self.path)}, video or model changed")
+                    for frame_path in self.path.glob("*.npy"):
+                        frame_path.unlink()
+        self.path.mkdir(exist_ok=True)
+        with key_path.open("w") as f:
+            json.dump(self.key, f, indent=2)
+
+    def get_frame_path(self, frame_index: int) -> Path:
+        return self.path / f"{frame_index:08d}.npy"
+
+    def __contains__(self, frame_index: int) -> bool:
+        return self.get_frame_path(frame_index).exists()
+
+    def load(
+        self, frame_index: int, device: torch.device, dtype: torch.dtype
+    ) -> ImageEmbedding | None:
+        frame_path = self.get_frame_path(frame_index)
+        if not frame_path.exists():
+            return None
+        try:
+            data = np.load(frame_path, mmap_mode="r")[0]
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {str(frame_path)}: {e}")
+            return None
+
+        def to_tensor(name: str) -> torch.Tensor:
+            return torch.from_numpy(np.array(data[name])).to(device=device, dtype=dtype)
+
+        feat_count = len(data.dtype.names) - 2
+        return ImageEmbedding(
+            features={
+                "image_embed": to_tensor("image_embed"),
+                "high_res_feats": [to_tensor(f"feat{i}") for i in range(feat_count)],
+            },
+            orig_hw=tuple(data["orig_hw"].tolist()),
+        )
+
+    def save(self, frame_index: int, embedding: ImageEmbedding) -> None:
+        tensors = {"image_embed": embedding.features["image_embed"]} | {
+            f"feat{i}": feat
+            for i, feat in enumerate(embedding.features["high_res_feats"])
+        }
+        # One record with a field per tensor, the shapes are in the file header
+        dtype = [("orig_hw", np.int64, (2,))] + [
+            (name, STORE_DTYPE, tuple(tensor.shape)) for name, tensor in tensors.items()
+        ]
+        data = np.zeros(1, dtype=dtype)
+        data["orig_hw"] = embedding.orig_hw
+        for name, tensor in tensors.items():
+            data[name] = tensor.detach().float().cpu().numpy()
+
+        frame_path = self.get_frame_path(frame_index)
+        tmp_path = frame_path.with_name(frame_path.name + ".tmp.npy")
+        np.save(tmp_path, data)
+        os.replace(tmp_path, frame_path)
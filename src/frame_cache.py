@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+FrameKey = tuple[str, int]  # (video path, frame index)
+
+
+def get_frame_key(video_path: Path, frame_index: int) -> FrameKey:
+    return str(video_path), frame_index
+
+
+class FrameCache:
+    # Least recently used decoded BGR frames, bounded by their size in bytes.
+    # One instance is shared by the viewer, the playback threads, the database
+    # loader and the segmenter, so it is thread safe. Cached frames are shared,
+    # callers must not modify them.
+    def __init__(self, max_bytes: int = 1024**3) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock_ = threading.Lock()
+        self.entries_: OrderedDict[FrameKey, np.ndarray] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries_)
+
+    def get(self, video_path: Path, frame_index: int) -> np.ndarray | None:
+        key = get_frame_key(video_path, frame_index)
+        with self.lock_:
+            frame = self.entries_.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.entries_.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, video_path: Path, frame_index: int, frame: np.ndarray) -> None:
+        key = get_frame_key(video_path, frame_index)
+        with self.lock_:
+            self.remove(key)
+            if frame.nbytes > self.max_bytes:
+                return
+            self.entries_[key] = frame
+            self.nbytes += frame.nbytes
+            self.evict()
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self.lock_:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def clear(self) -> None:
+        with self.lock_:
+            self.entries_.clear()
+            self.nbytes = 0
+
+    def get_stats(self) -> str:
+        with self.lock_:
+            lookups = max(self.hits + self.misses, 1)
+            return (
+                f"{len(self.entries_)} frames, {self.nbytes / 1024**2:.0f} MiB, "
+                f"{self.hits} hits, {self.misses} misses "
+                f"({100 * self.hits / lookups:.0f}% hit rate)"
+            )
+
+    def remove(self, key: FrameKey) -> None:
+        # Lock held by the caller
+        frame = self.entries_.pop(key, None)
+        if frame is not None:
+            self.nbytes -= frame.nbytes
+
+    def evict(self) -> None:
+        # Lock held by the caller
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries_.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+
+_frame_cache = FrameCache()
+
+
+def shared_frame_cache() -> FrameCache:
+    return _frame_cache
@@ -0,0 +1,145 @@
+import threading
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+from frame_cache import FrameCache
+from video_index import VideoIndex
+from video_source import GopReader, open_video_source
+
+
+class FramePrefetcher:
+    # Decodes the frames ahead of playback on a background thread, in the play
+    # direction and at the play speed, into a bounded buffer. The GUI thread
+    # takes them with get(), a miss falls back to a synchronous read.
+    # The thread has its own video source, decoders are not thread safe.
+    # Decoded frames also go to the frame cache, reverse playback is served
+    # from it GOP by GOP once the video index is set, see GopReader.
+    def __init__(
+        self,
+        video_path: Path,
+        video_index: VideoIndex | None,
+        frame_cache: FrameCache,
+        capacity: int = 16,
+    ) -> None:
+        self.video_path = video_path
+        self.frame_cache = frame_cache
+        self.video_source_ = open_video_source(video_path)
+        self.gop_reader_ = GopReader(self.video_source_, video_index, frame_cache)
+        self.frame_count = self.video_source_.frame_count
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        self.condition_ = threading.Condition()
+        self.buffer_: deque[tuple[int, np.ndarray]] = deque()  # (index, frame)
+        self.next_index_ = 0  # Next frame to decode
+        self.decoding_index_: int | None = None  # Frame the thread is decoding
+        self.step_ = 1  # Frames between two buffered frames, negative in reverse
+        self.playing_ = False
+        # Incremented when the buffer is invalidated, a frame decoded for an
+        # older generation is dropped
+        self.generation_ = 0
+        self.should_stop_ = False
+
+        self.thread_ = threading.Thread(target=self.run, daemon=True)
+        self.thread_.start()
+
+    def set_video_index(self, video_index: VideoIndex) -> None:
+        # Read by the thread with the next GOP it decodes
+        self.gop_reader_.video_index = video_index
+
+    def start(self, index: int, step: int) -> None:
+        # Playback from index at step frames per tick
+        assert step != 0
+        with self.condition_:
+            if step != self.step_:
+                self.step_ = step
+                self.invalidate(index)
+            self.playing_ = True
+            self.condition_.notify_all()
+
+    def pause(self) -> None:
+        # The buffer is kept for when playback resumes
+        with self.condition_:
+            self.playing_ = False
+
+    def seek(self, index: int) -> None:
+        # Slider jump, the buffered frames are not ahead of index anymore
+        with self.condition_:
+            self.invalidate(index)
+            self.condition_.notify_all()
+
+    def invalidate(self, index: int) -> None:
+        # Condition held by the caller
+        self.buffer_.clear()
+        self.generation_ += 1
+        self.next_index_ = index + self.step_
+
+    def is_behind(self, index: int, reference: int) -> bool:
+        return (index - reference) * self.step_ < 0
+
+    def get(self, index: int, timeout: float = 0.5) -> np.ndarray | None:
+        with self.condition_:
+            # Waiting for the frame being decoded beats decoding it twice
+            self.condition_.wait_for(
+                lambda: self.decoding_index_ != index, timeout=timeout
+            )
+            # Frames playback skipped past are dropped
+            while self.buffer_ and self.is_behind(self.buffer_[0][0], index):
+                self.buffer_.popleft()
+            if self.buffer_ and self.buffer_[0][0] == index:
+                self.hits += 1
+                self.condition_.notify_all()
+                return self.buffer_.popleft()[1]
+
+            self.misses += 1
+            if not self.buffer_ and not self.is_behind(index, self.next_index_):
+                # Decoding fell behind playback, continue after this frame
+                self.invalidate(index)
+                self.condition_.notify_all()
+            return None
+
+    def run(self) -> None:
+        while True:
+            with self.condition_:
+                while not self.should_stop_ and (
+                    not self.playing_
+                    or len(self.buffer_) >= self.capacity
+                    or not 0 <= self.next_index_ < self.frame_count
+                ):
+                    self.condition_.wait()
+                if self.should_stop_:
+                    break
+                index = self.next_index_
+                generation = self.generation_
+                step = self.step_
+                self.next_index_ += self.step_
+                self.decoding_index_ = index
+
+            if step > 0:
+                frame = self.frame_cache.get(self.video_path, index)
+                if frame is None:
+                    # Grabs the frames in between instead of seeking
+                    frame = next(
+                        self.video_source_.read_batch([index], "sequential")
+                    )[1]
+                    if frame is not None:
+                        self.frame_cache.put(self.video_path, index, frame)
+            else:
+                # Each GOP is decoded once and served backwards from the cache
+                frame = self.gop_reader_.read(index, -step)
+
+            with self.condition_:
+                if generation == self.generation_ and frame is not None:
+                    self.buffer_.append((index, frame))
+                self.decoding_index_ = None
+                self.condition_.notify_all()
+
+    def stop(self) -> None:
+        with self.condition_:
+            self.should_stop_ = True
+            self.condition_.notify_all()
+        self.thread_.join()
+        self.video_source_.release()
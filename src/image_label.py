@@ -1,47 +1,83 @@
-from PySide6.QtCore import QPointF
+import time
+
+from PySide6.QtCore import QPointF, QSize
 import numpy as np
-from PySide6.QtGui import QImage, QPixmap, QResizeEvent
+from PySide6.QtGui import QImage, QPainter, QPaintEvent, QResizeEvent
 from PySide6.QtWidgets import (
     QLabel,
 )
 
 
 class ImageLabel(QLabel):
+    # Paints the frame itself instead of converting it to a QPixmap. The QImage
+    # wraps the buffer of the array without a copy, image_ keeps the array
+    # alive while the QImage uses it. Scaling to the widget happens while
+    # painting, so only the displayed pixels are touched.
     def __init__(self):
         super().__init__()
 
         self.image_: np.ndarray | None = None
+        self.qimage_: QImage | None = None
+        # Size of the full resolution frame, which sets the size hint, the
+        # aspect and the image positions, whatever array is shown
+        self.display_size_: QSize | None = None
         self.aspect_ = 1.0
+        # Time spent wrapping the last frame and painting it
+        self.convert_ms = 0.0
+        self.paint_ms = 0.0
 
-        self.setScaledContents(True)
-
-    def set_image(self, image: np.ndarray):
-        self.image_ = image
+    def set_image(self, image: np.ndarray, display_size: QSize | None = None):
+        # display_size is the size of the full resolution frame when image is
+        # a smaller stand-in for it, such as a proxy thumbnail
+        start_time = time.perf_counter()
 
-        # Ensure the image is in the correct format (BGR888 or RGB888)
+        # Ensure the image is in the correct format (BGR888)
         height = image.shape[0]
         width = image.shape[1]
         assert image.shape == (height, width, 3)
 
-        # Convert NumPy array to bytes
-        image_bytes = image.tobytes()
+        # QImage needs packed pixels in a writable buffer. Decoded frames
+        # already are, memory mapped proxy thumbnails are read only.
+        if not image.flags.c_contiguous or not image.flags.writeable:
+            image = image.copy()
+        self.image_ = image
 
-        # Create QImage from the byte array
+        if display_size is None:
+            display_size = QSize(width, height)
+        size_changed = display_size != self.display_size_
+        self.display_size_ = display_size
         self.qimage_ = QImage(
-            image_bytes,
+            image.data,
             width,
             height,
             image.strides[0],  # bytes per line
             QImage.Format_BGR888,
         )
 
-        self.aspect_ = width / height
-
-        # Create a QPixmap from the QImage
-        pixmap = QPixmap.fromImage(self.qimage_)
-        self.setPixmap(pixmap)
+        self.aspect_ = display_size.width() / display_size.height()
         self.setMinimumSize(1, 1)
+        if size_changed:
+            self.updateGeometry()
         self.update_margins()
+        self.update()
+        self.convert_ms = (time.perf_counter() - start_time) * 1000
+
+    def sizeHint(self) -> QSize:
+        # Like a QLabel showing the frame as a pixmap
+        if self.display_size_ is None:
+            return super().sizeHint()
+        return self.display_size_.grownBy(self.contentsMargins())
+
+    def paintEvent(self, event: QPaintEvent) -> None:
+        if self.qimage_ is None:
+            return super().paintEvent(event)
+
+        start_time = time.perf_counter()
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        painter.drawImage(self.contentsRect(), self.qimage_)
+        painter.end()
+        self.paint_ms = (time.perf_counter() - start_time) * 1000
 
     def resizeEvent(self, event: QResizeEvent) -> None:
         self.update_margins()
@@ -71,7 +107,9 @@ class ImageLabel(QLabel):
 
         relPos = localPos / labelSize
         relPos[0], relPos[1] = relPos[1], relPos[0]
-        pixelPos = relPos * self.image_.shape[0:2]
+        pixelPos = relPos * np.array(
+            [self.display_size_.height(), self.display_size_.width()]
+        )
         pixelPos[0], pixelPos[1] = pixelPos[1], pixelPos[0]
         pixelPos = pixelPos.reshape(1, 2)
         return pixelPos
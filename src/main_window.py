@@ -1,14 +1,13 @@
 import datetime
 import json
 import sys
+import threading
 import time
 from pathlib import Path
-from queue import SimpleQueue
 
 import PySide6.QtGui as QtGui
-import cv2
 import numpy as np
-from PySide6.QtCore import Qt, QTimer, QEvent
+from PySide6.QtCore import Qt, QTimer, QEvent, QSize, Signal
 from PySide6.QtGui import QAction, QMouseEvent, QStatusTipEvent
 from PySide6.QtWidgets import (
     QApplication,
@@ -19,6 +18,7 @@ from PySide6.QtWidgets import (
     QMessageBox,
     QWidget,
     QHBoxLayout,
+    QInputDialog,
     QLabel,
     QMenuBar,
     QMenu,
@@ -26,22 +26,42 @@ from PySide6.QtWidgets import (
 
 from drawing import draw_clicks
 from database import active_db, set_db, DatabaseFrame
+from frame_cache import shared_frame_cache
+from frame_prefetcher import FramePrefetcher
 from image_label import ImageLabel
 from mark_canvas import MarkCanvas
 from serialization import deserialize_database, serialize_database
 from side_menu import SideMenu
 from help import HelpMenu
 from motion_detector_ui import MotionDetectorUi
+from segmentation_queue import SegmentationQueue
 from utils import pretty_time_delta
+from video_index import VideoIndex, load_video_index
+from video_proxy import VideoProxy, load_video_proxy
+from video_source import GopReader, VideoSource, open_video_source
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, work_queue: SimpleQueue, videos_path: str) -> None:
+    # (video path, VideoIndex), emitted by the thread that builds the index
+    video_index_loaded = Signal(object, object)
+
+    def __init__(self, work_queue: SegmentationQueue, videos_path: str) -> None:
         super().__init__()
 
         # Initialize variables
         self.work_queue_ = work_queue
-        self.video_reader_ = None
+        self.video_source_: VideoSource | None = None
+        # None until the background thread has built or read the index
+        self.video_index_: VideoIndex | None = None
+        self.video_path_: Path | None = None
+        # Decodes ahead of playback, the frames of a slider jump are read
+        # through gop_reader_. Both keep what they decode in the shared frame
+        # cache.
+        self.prefetcher_: FramePrefetcher | None = None
+        self.gop_reader_: GopReader | None = None
+        # Thumbnails shown while the slider is dragged, if generated
+        self.proxy_: VideoProxy | None = None
+        self.showing_proxy_ = False
         self.video_fps_ = 1
         self.last_advance_time_ms = 0
         self.image_: np.ndarray | None = None
@@ -87,6 +107,7 @@ class MainWindow(QMainWindow):
         self.position_slider_.setMaximum(100)
         self.position_slider_.setValue(0)
         self.position_slider_.valueChanged.connect(self.set_position)
+        self.position_slider_.sliderReleased.connect(self.slider_released)
 
         # Buttons Layout (Horizontal layout for buttons)
         button_layout = QHBoxLayout()
@@ -130,6 +151,7 @@ class MainWindow(QMainWindow):
         self.statusLabels_["sam2"] = QLabel("")
         self.statusLabels_["video_speed"] = QLabel("0x")
         self.statusLabels_["video_time"] = QLabel("0s")
+        self.statusLabels_["display"] = QLabel("")
         for label in self.statusLabels_.values():
             statusBar.addPermanentWidget(label)
 
@@ -150,6 +172,9 @@ class MainWindow(QMainWindow):
             self.create_action("Name ↓", self.side_menu.next_name, Qt.Key.Key_Down)
         )
 
+        # Queued connection, the index is handed over on the GUI thread
+        self.video_index_loaded.connect(self.set_video_index)
+
         # Load the first video
         self.load_video(self.current_video_index_)
 
@@ -162,6 +187,9 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
         if active_db().is_dirty:
             serialize_database()
+        if self.prefetcher_ is not None:
+            self.prefetcher_.stop()
+            self.prefetcher_ = None
 
     def event(self, event: QEvent) -> bool:
         if isinstance(event, QStatusTipEvent):
@@ -176,28 +204,61 @@ class MainWindow(QMainWindow):
             return True
         return super().event(event)
 
+    def show_status(self, message: str) -> None:
+        # "key:text" updates a permanent status label, see event()
+        QApplication.sendEvent(self, QStatusTipEvent(message))
+
+    def set_video_index(self, video_path: Path, video_index: VideoIndex) -> None:
+        # Dropped if another video was loaded since
+        if video_path != self.video_path_:
+            return
+        self.video_index_ = video_index
+        if self.gop_reader_ is not None:
+            self.gop_reader_.video_index = video_index
+        if self.prefetcher_ is not None:
+            self.prefetcher_.set_video_index(video_index)
+
     def load_video(self, index: int) -> None:
         if active_db().is_dirty:
             serialize_database()
 
         video_path = self.video_files_[index]
         print(f"Loading {str(video_path)}")
-
-        # Use decord for video reading
-        self.video_reader_ = cv2.VideoCapture(str(video_path))
-        self.frame_count_ = int(self.video_reader_.get(cv2.CAP_PROP_FRAME_COUNT))
+        print(f"Frame cache: {shared_frame_cache().get_stats()}")
+
+        if self.video_source_ is not None:
+            self.video_source_.release()
+        self.video_source_ = open_video_source(video_path)
+        self.video_path_ = video_path
+        self.video_index_ = None
+        self.proxy_ = load_video_proxy(video_path)
+        self.gop_reader_ = GopReader(self.video_source_, None, shared_frame_cache())
+        if self.prefetcher_ is not None:
+            self.prefetcher_.stop()
+        self.prefetcher_ = FramePrefetcher(video_path, None, shared_frame_cache())
+        # The first load of a video demuxes all of it, the frames are read
+        # with plain seeks meanwhile
+        threading.Thread(
+            target=lambda: self.video_index_loaded.emit(
+                video_path, load_video_index(video_path)
+            ),
+            daemon=True,
+        ).start()
+        self.frame_count_ = self.video_source_.frame_count
 
         # Reset database
         set_db(
-            deserialize_database(video_path=video_path, video_reader=self.video_reader_)
+            deserialize_database(video_path=video_path, video_source=self.video_source_)
         )
 
-        # Submit all frames to background segmenter
+        # Submit all frames to background segmenter, frames of the previous
+        # video still waiting are dropped
+        self.work_queue_.clear()
         for frame in active_db().frames.values():
             self.work_queue_.put(frame.frame)
 
         # Set the timer interval based on the framerate
-        self.video_fps_ = self.video_reader_.get(cv2.CAP_PROP_FPS)
+        self.video_fps_ = self.video_source_.fps
         if self.video_fps_ < 1:
             self.video_fps_ = 24  # Assume if invalid
 
@@ -205,12 +266,14 @@ class MainWindow(QMainWindow):
         print(f"FPS: {self.video_fps_}")
 
         # Get the first frame to determine the size
-        self.original_width = self.video_reader_.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.original_height = self.video_reader_.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.original_width = self.video_source_.width
+        self.original_height = self.video_source_.height
         print(f"Image size: {(self.original_width, self.original_height)}")
 
         self.position_slider_.setMaximum(self.frame_count_ - 1)
         self.display_image_by_index(0)
+        if self.playback_speed_ != 0:
+            self.prefetcher_.start(0, self.playback_speed_)
 
         json_file_path_for_movement = video_path.with_suffix(".json")
 
@@ -266,8 +329,12 @@ class MainWindow(QMainWindow):
 
         if speed == 0:
             self.ensure_stopped()
+            if self.prefetcher_ is not None:
+                self.prefetcher_.pause()
         else:
             self.ensure_playing()
+            if self.prefetcher_ is not None:
+                self.prefetcher_.start(self.frame_index_, speed)
 
     def increase_speed(self):
         if self.playback_speed_ == 0:
@@ -286,8 +353,19 @@ class MainWindow(QMainWindow):
             self.set_play_speed(0)
 
     def set_position(self, position):
-        if self.video_reader_:
-            self.display_image_by_index(position)
+        # Also called back by display_image_by_index moving the slider, only
+        # a change of position is a jump
+        if self.video_source_ and position != self.frame_index_:
+            if self.prefetcher_ is not None:
+                self.prefetcher_.seek(position)
+            self.display_image_by_index(
+                position, preview=self.position_slider_.isSliderDown()
+            )
+
+    def slider_released(self):
+        # Swap the proxy thumbnail for the full resolution frame
+        if self.showing_proxy_:
+            self.display_image_by_index(self.frame_index_)
 
     def advance_frame(self):
         now_ms = time.time() * 1000
@@ -298,11 +376,15 @@ class MainWindow(QMainWindow):
 
         time_factor = self.video_fps_ / (1000 / duration_ms)
 
-        new_frame_index = self.frame_index_ + int(self.playback_speed_ * time_factor)
+        # Whole steps of the play speed, so playback stays on the frames the
+        # prefetcher decodes. A late tick skips steps.
+        steps = max(round(time_factor), 1)
+        new_frame_index = self.frame_index_ + self.playback_speed_ * steps
         self.display_image_by_index(new_frame_index)
 
-    def display_image_by_index(self, index: int):
-        if not self.video_reader_:
+    def display_image_by_index(self, index: int, preview: bool = False):
+        # A preview shows the proxy thumbnail of a frame that is not decoded yet
+        if not self.video_source_:
             return
 
         if index < 0:
@@ -313,6 +395,9 @@ class MainWindow(QMainWindow):
             index = self.frame_count_ - 1
 
         self.frame_index_ = index
+        self.showing_proxy_ = False
+        # The segmenter handles the frame on screen first
+        self.work_queue_.set_current_frame(index)
         db_frame = active_db().frames.get(self.frame_index_)
         if db_frame is not None:
             # Display image from the database
@@ -323,22 +408,50 @@ class MainWindow(QMainWindow):
             )
         else:
             # Nothing in db, just display raw from video
-            self.video_reader_.set(cv2.CAP_PROP_POS_FRAMES, self.frame_index_)
-            ret, cv_frame = self.video_reader_.read()
-            if not ret:
+            cv_frame = None
+            if self.playback_speed_ != 0 and self.prefetcher_ is not None:
+                cv_frame = self.prefetcher_.get(self.frame_index_)
+            if cv_frame is None and preview and self.proxy_ is not None:
+                cv_frame = shared_frame_cache().get(active_db().video_path, index)
+                if cv_frame is None:
+                    cv_frame = self.proxy_.get(index)
+                    self.showing_proxy_ = True
+            if cv_frame is None and self.gop_reader_ is not None:
+                # On the grid of reverse playback, the frames the prefetcher
+                # caches
+                cv_frame = self.gop_reader_.read(
+                    self.frame_index_, max(-self.playback_speed_, 1)
+                )
+            if cv_frame is None:
                 return
             self.image_ = cv_frame
         assert self.image_ is not None
-        self.image_label_.set_image(self.image_)
+        # A proxy thumbnail is laid out at the size of the video, so the view
+        # does not shrink while the slider is dragged
+        self.image_label_.set_image(
+            self.image_, QSize(self.original_width, self.original_height)
+        )
         self.position_slider_.setValue(self.frame_index_)
 
-        video_time = datetime.timedelta(seconds=self.frame_index_ / self.video_fps_)
+        if self.video_index_ is not None:
+            seconds = self.video_index_.get_time(self.frame_index_, self.video_fps_)
+        else:
+            seconds = self.frame_index_ / self.video_fps_
+        video_time = datetime.timedelta(seconds=seconds)
         QApplication.sendEvent(
             self,
             QStatusTipEvent(
                 f"video_time:frame {self.frame_index_} ({pretty_time_delta(video_time.total_seconds())})"
             ),
         )
+        # Paint time of the previous frame, painting happens after this returns
+        QApplication.sendEvent(
+            self,
+            QStatusTipEvent(
+                f"display:convert {self.image_label_.convert_ms:.1f} ms, "
+                f"paint {self.image_label_.paint_ms:.1f} ms"
+            ),
+        )
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -348,6 +461,9 @@ class MainWindow(QMainWindow):
             assert self.image_ is not None
             if self.timer_.isActive():
                 self.toggle_play_pause()
+            if self.showing_proxy_:
+                # Points are placed on the full resolution frame
+                self.display_image_by_index(self.frame_index_)
 
             pixelPos = self.image_label_.event_to_image_position(ev.position())
 
@@ -393,6 +509,12 @@ class MainWindow(QMainWindow):
         motion_detection_action.triggered.connect(self.detect_motion)
         file_menu.addAction(motion_detection_action)
 
+        # Segmentation menu
+        segmentation_menu = QMenu("Segmentation", self)
+        propagate_action = QAction("Propagate Masks From This Frame...", self)
+        propagate_action.triggered.connect(self.propagate_masks)
+        segmentation_menu.addAction(propagate_action)
+
         # Help menu
         help_menu = QMenu("Help", self)
         help_action = QAction("Help", self)
@@ -401,6 +523,7 @@ class MainWindow(QMainWindow):
 
         # Add menus to the menu bar
         menu_bar.addMenu(file_menu)
+        menu_bar.addMenu(segmentation_menu)
         menu_bar.addMenu(help_menu)
 
         # Set the menu bar for the main window
@@ -410,6 +533,22 @@ class MainWindow(QMainWindow):
         self.motion_detection_ui = MotionDetectorUi(self.videos_path)
         self.motion_detection_ui.show()
 
+    def propagate_masks(self):
+        frame = active_db().frames.get(self.frame_index_)
+        if frame is None or all(
+            record.derived_from is not None for record in frame.records.values()
+        ):
+            QMessageBox.information(
+                self, "Info", "Annotate this frame before propagating its masks."
+            )
+            return
+
+        frame_count, ok = QInputDialog.getInt(
+            self, "Propagate Masks", "Frames in each direction:", 30, 1, 10000
+        )
+        if ok:
+            self.work_queue_.put_propagation(self.frame_index_, frame_count)
+
     def open_help_menu(self):
         """Open the Help menu dialog"""
         help_dialog = HelpMenu()
@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import cv2
+import numpy as np
+import sam2.sam2_video_predictor
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+from sam2_config import SAM2_CHECKPOINT_DIR, SAM2_MODELS
+from video_source import VideoSource, open_video_source
+
+# Normalization of the SAM2 video frame loader
+IMAGE_MEAN = torch.tensor([0.485, 0.456, 0.406])[:, None, None]
+IMAGE_STD = torch.tensor([0.229, 0.224, 0.225])[:, None, None]
+
+
+class ClipFrames:
+    # Frames of a clip of the video as the square, normalized RGB tensors the
+    # SAM2 video predictor indexes, decoded when the predictor asks for them
+    # instead of loading the whole clip up front
+    def __init__(
+        self,
+        video_source: VideoSource,
+        first_frame: int,
+        frame_count: int,
+        image_size: int,
+    ) -> None:
+        self.video_source = video_source
+        self.first_frame = first_frame
+        self.frame_count = frame_count
+        self.image_size = image_size
+        # Decoded BGR frames, until the caller takes them with pop_frame
+        self.frames_: dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        frame_index = self.first_frame + index
+        frame = self.frames_.get(frame_index)
+        if frame is None:
+            frame = self.video_source.read(frame_index)
+            if frame is None:
+                raise RuntimeError(f"Cannot read frame {frame_index}")
+            self.frames_[frame_index] = frame
+
+        image = cv2.resize(
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),
+            (self.image_size, self.image_size),
+            interpolation=cv2.INTER_AREA,
+        )
+        tensor = torch.from_numpy(image).permute(2, 0, 1).float() / 255.0
+        return (tensor - IMAGE_MEAN) / IMAGE_STD
+
+    def pop_frame(self, frame_index: int) -> np.ndarray | None:
+        return self.frames_.pop(frame_index, None)
+
+
+@contextmanager
+def use_frame_loader(clip_frames: ClipFrames) -> Iterator[None]:
+    # init_state reads the whole video through load_video_frames, hand it the
+    # lazy clip instead
+    def load_video_frames(**kwargs) -> tuple[ClipFrames, int, int]:
+        return (
+            clip_frames,
+            clip_frames.video_source.height,
+            clip_frames.video_source.width,
+        )
+
+    original = sam2.sam2_video_predictor.load_video_frames
+    sam2.sam2_video_predictor.load_video_frames = load_video_frames
+    try:
+        yield
+    finally:
+        sam2.sam2_video_predictor.load_video_frames = original
+
+
+class MaskPropagator:
+    # Tracks the masks of the records of an annotated frame to the frames
+    # around it, with the memory bank of the SAM2 video predictor
+    def __init__(
+        self,
+        device: torch.device,
+        model: str = "large",
+        checkpoint_dir: Path | None = SAM2_CHECKPOINT_DIR,
+    ) -> None:
+        model_cfg, checkpoint_name = SAM2_MODELS[model]
+        self.predictor_ = build_sam2_video_predictor(
+            model_cfg,
+            None if checkpoint_dir is None else str(checkpoint_dir / checkpoint_name),
+            device=device,
+        )
+
+    @torch.inference_mode()
+    def propagate(
+        self,
+        video_path: Path,
+        frame_index: int,
+        prompts: dict[str, tuple[np.ndarray, np.ndarray]],
+        frame_count: int,
+    ) -> Iterator[tuple[int, np.ndarray, dict[str, np.ndarray]]]:
+        # Yields (frame index, BGR image, {name: mask}) for up to frame_count
+        # frames after frame_index, then for up to frame_count frames before it,
+        # moving away from the annotated frame. prompts are the (positive,
+        # negative) points of each record on the annotated frame.
+        video_source = open_video_source(video_path)
+        first_frame = max(frame_index - frame_count, 0)
+        last_frame = min(frame_index + frame_count, video_source.frame_count - 1)
+        clip_frames = ClipFrames(
+            video_source,
+            first_frame,
+            last_frame - first_frame + 1,
+            self.predictor_.image_size,
+        )
+
+        try:
+            with use_frame_loader(clip_frames):
+                state = self.predictor_.init_state(
+                    video_path=str(video_path), offload_video_to_cpu=True
+                )
+
+            names = list(prompts)
+            start = frame_index - first_frame
+            for obj_id, name in enumerate(names):
+                positive, negative = prompts[name]
+                labels = np.zeros(len(positive) + len(negative), dtype=np.int32)
+                labels[: len(positive)] = 1
+                self.predictor_.add_new_points_or_box(
+                    state,
+                    frame_idx=start,
+                    obj_id=obj_id,
+                    points=np.concatenate([positive, negative]).astype(np.float32),
+                    labels=labels,
+                )
+
+            for reverse in [False, True]:
+                for index, obj_ids, mask_logits in self.predictor_.propagate_in_video(
+                    state,
+                    start_frame_idx=start,
+                    max_frame_num_to_track=frame_count,
+                    reverse=reverse,
+                ):
+                    if index == start:
+                        # The annotated frame keeps its own segmentation
+                        continue
+                    image = clip_frames.pop_frame(first_frame + index)
+                    if image is None:
+                        image = video_source.read(first_frame + index)
+                    masks = (mask_logits[:, 0] > 0.0).cpu().numpy().astype(np.uint8)
+                    yield first_frame + index, image, {
+                        names[obj_id]: mask for obj_id, mask in zip(obj_ids, masks)
+                    }
+        finally:
+            video_source.release()
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def get_motion_json_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".json")
+
+
+def get_partial_json_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".json.partial")
+
+
+def get_partial_areas_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".areas.partial")
+
+
+def get_partial_offsets_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".offsets.partial")
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    # Readers either see the previous file or the complete new one
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MotionCheckpoint:
+    # Keeps a JSON lines log next to the video with the detection parameters,
+    # every motion period as soon as it is closed and the scan state at each
+    # checkpoint, so an interrupted detection can continue where it stopped.
+    # The blob areas of the samples are appended to two binary files laid out
+    # like the motion scores: the areas back to back as float32 and, per
+    # sample, the end of its areas and whether it was read as int64. A state
+    # entry records how many of them it covers, data written after the last
+    # state is ignored.
+    def __init__(self, video_path: Path, params: dict[str, Any]) -> None:
+        self.path = get_partial_json_path(video_path)
+        self.areas_path = get_partial_areas_path(video_path)
+        self.offsets_path = get_partial_offsets_path(video_path)
+        # Round trip so the comparison with the loaded header is exact
+        self.params = json.loads(json.dumps(params))
+        self.file: TextIO | None = None
+        self.areas_file: BinaryIO | None = None
+        self.offsets_file: BinaryIO | None = None
+        self.sample_count = 0
+        self.area_count = 0
+
+    def load(
+        self,
+    ) -> tuple[dict[str, Any], list[dict[str, Any]], list[np.ndarray | None]] | None:
+        # Returns the last saved state, the periods closed before it and the
+        # blob areas of every sample up to it
+        if not self.path.exists():
+            return None
+
+        entries = []
+        with self.path.open("r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Last line was cut short by the crash
+                    break
+
+        # The header first, entries written with other parameters may not
+        # have the fields read below
+        if not entries or not isinstance(entries[0], dict):
+            return None
+        if entries[0].get("params") != self.params:
+            logger.info(f"Ignoring {str(self.path)}, detection parameters changed")
+            return None
+
+        state = None
+        sample_count = 0
+        area_count = 0
+        motion_periods = []
+        try:
+            for entry in entries[1:]:
+                if "period" in entry:
+                    motion_periods.append(entry["period"])
+                elif "state" in entry:
+                    state = entry["state"]
+                    sample_count = entry["sample_count"]
+                    area_count = entry["area_count"]
+            if state is None:
+                return None
+
+            # Periods closed after the last checkpoint will be detected again
+            motion_periods = [
+                period
+                for period in motion_periods
+                if period["end_frames"] <= state["frame_index"]
+            ]
+            offsets = np.fromfile(self.offsets_path, dtype=np.int64)
+            offsets = offsets[: 2 * sample_count].reshape(-1, 2)
+            areas = np.fromfile(self.areas_path, dtype=np.float32)[:area_count]
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            logger.info(f"Ignoring {str(self.path)}, malformed entry: {e}")
+            return None
+        if len(offsets) != sample_count or len(areas) != area_count:
+            logger.info(f"Ignoring {str(self.path)}, sample areas missing")
+            return None
+
+        starts = np.concatenate([[0], offsets[:-1, 0]]).astype(np.int64)
+        sample_areas = [
+            areas[start:end] if valid else None
+            for start, (end, valid) in zip(starts.tolist(), offsets.tolist())
+        ]
+        return state, motion_periods, sample_areas
+
+    def start(
+        self,
+        state: dict[str, Any],
+        motion_periods: list[dict[str, Any]],
+        sample_areas: list[np.ndarray | None],
+    ) -> None:
+        # Rewrite the log with what is kept, then keep appending to it
+        self.file = self.path.open("w")
+        self.areas_file = self.areas_path.open("wb")
+        self.offsets_file = self.offsets_path.open("wb")
+        self.sample_count = 0
+        self.area_count = 0
+        self.write_entry({"params": self.params})
+        for period in motion_periods:
+            self.write_entry({"period": period})
+        self.save(state, sample_areas)
+
+    def add_period(self, period: dict[str, Any]) -> None:
+        self.write_entry({"period": period})
+
+    def save(
+        self, state: dict[str, Any], sample_areas: list[np.ndarray | None]
+    ) -> None:
+        # The areas reach the disk before the state that refers to them
+        assert self.areas_file is not None and self.offsets_file is not None
+        offsets = []
+        for areas in sample_areas:
+            if areas is not None:
+                self.areas_file.write(np.asarray(areas, dtype=np.float32).tobytes())
+                self.area_count += len(areas)
+            offsets.append((self.area_count, areas is not None))
+        self.offsets_file.write(np.array(offsets, dtype=np.int64).tobytes())
+        self.sample_count += len(sample_areas)
+        for f in (self.areas_file, self.offsets_file):
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.write_entry(
+            {
+                "state": state,
+                "sample_count": self.sample_count,
+                "area_count": self.area_count,
+            }
+        )
+        assert self.file is not None
+        os.fsync(self.file.fileno())
+
+    def write_entry(self, entry: dict[str, Any]) -> None:
+        assert self.file is not None
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def finalize(self, output_json: Path, motion_periods: list[dict[str, Any]]) -> None:
+        write_json_atomic(output_json, motion_periods)
+        for f in (self.file, self.areas_file, self.offsets_file):
+            if f is not None:
+                f.close()
+        self.file = self.areas_file = self.offsets_file = None
+        for path in (self.path, self.areas_path, self.offsets_path):
+            path.unlink(missing_ok=True)
@@ -1,14 +1,485 @@
-import json
 import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    TimeoutError,
+    wait,
+)
+from dataclasses import dataclass, field
 from pathlib import Path
+from queue import Empty
+from typing import Any, Callable, Iterator, TextIO
 
 import cv2
+import numpy as np
 from tqdm import tqdm
 
-from utils import pretty_time_delta
+from motion_checkpoint import (
+    MotionCheckpoint,
+    get_motion_json_path,
+    write_json_atomic,
+)
+from motion_scores import load_motion_scores, sample_movements, save_motion_scores
+from utils import init_batch_worker, pretty_time_delta
+from video_source import (
+    DECODE_MODES,
+    VIDEO_BACKENDS,
+    choose_decode_mode,
+    estimate_keyframe_interval,
+    open_video_source,
+)
 
 logger = logging.getLogger(__name__)
 
+MOTION_METRICS = ("contours", "components")
+DETECTORS = ("frame_diff", "running_average", "mog2")
+
+
+@dataclass
+class ScanSettings:
+    frame_step: int
+    min_contour_area_px: float
+    crop: tuple[int, int, int, int]  # top, bottom, left, right in pixels
+    analysis_size: tuple[int, int]  # width, height
+    decode_mode: str = "seek"
+    motion_metric: str = "contours"
+    backend: str = "opencv"
+    detector: str = "frame_diff"
+    # Samples fed to a background model before a chunk or a resumed scan
+    warmup_samples: int = 60
+
+
+def get_crop(
+    width: int,
+    height: int,
+    cut_top=None,
+    cut_bottom=None,
+    cut_right=None,
+    cut_left=None,
+) -> tuple[int, int, int, int]:
+    # The cuts are percentages of the frame removed from each side
+    crop_x = int(cut_left / 100 * width if cut_left else 0)
+    crop_y = int(cut_top / 100 * height if cut_top else 0)
+    crop_xx = width - int(cut_right / 100 * width if cut_right else 0)
+    crop_yy = height - int(cut_bottom / 100 * height if cut_bottom else 0)
+    assert crop_x < crop_xx and crop_y < crop_yy, "Cuts leave an empty frame"
+    return crop_y, crop_yy, crop_x, crop_xx
+
+
+def get_analysis_size(
+    crop: tuple[int, int, int, int], analysis_width: int | None
+) -> tuple[int, int]:
+    # Without a target width the region is analysed at half resolution
+    crop_width = crop[3] - crop[2]
+    crop_height = crop[1] - crop[0]
+    if analysis_width is None or analysis_width <= 0:
+        return max(crop_width // 2, 1), max(crop_height // 2, 1)
+    analysis_width = min(analysis_width, crop_width)
+    return analysis_width, max(round(crop_height * analysis_width / crop_width), 1)
+
+
+def preprocess_frame(frame: np.ndarray, settings: ScanSettings) -> np.ndarray:
+    # Crop with a view and shrink before converting, so the cost follows the
+    # analysis size rather than the sensor size
+    top, bottom, left, right = settings.crop
+    roi = frame[top:bottom, left:right]
+    down_scale = cv2.resize(roi, settings.analysis_size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(down_scale, cv2.COLOR_BGR2GRAY)
+    return gray
+
+
+def contour_areas(binary_image: np.ndarray) -> np.ndarray:
+    contours, _ = cv2.findContours(
+        binary_image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
+    )
+    areas = np.array([cv2.contourArea(c) for c in contours], dtype=np.float32)
+    return areas[areas > 0]
+
+
+def component_areas(binary_image: np.ndarray) -> np.ndarray:
+    # One labelling pass, the areas come out of the stats table as an array
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary_image, connectivity=8)
+    return stats[1:, cv2.CC_STAT_AREA].astype(np.float32)  # Label 0 is the background
+
+
+def total_movement(areas: np.ndarray | None, min_area_px: float) -> float | None:
+    # Areas are whole or half pixels, so the sum is exact in any order
+    if areas is None:
+        return None
+    return float(areas[areas > min_area_px].sum(dtype=np.float64))
+
+
+class ForegroundDetector:
+    # Produces the mask of moving pixels for each new sample. frame_diff
+    # compares against the previous sample, the other detectors against a
+    # background model that absorbs slow lighting changes and camera noise.
+    def __init__(self, detector: str, background_alpha=0.05, history=50) -> None:
+        assert detector in DETECTORS
+        self.detector = detector
+        self.background_alpha = background_alpha
+        self.previous: np.ndarray | None = None
+        self.background: np.ndarray | None = None
+        self.subtractor = None
+        if detector == "mog2":
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(
+                history=history, detectShadows=False
+            )
+
+    def apply(self, frame: np.ndarray) -> np.ndarray | None:
+        # Returns None while the model has nothing to compare against
+        if self.detector == "mog2":
+            assert self.subtractor is not None
+            mask = self.subtractor.apply(frame)
+            is_first = self.previous is None
+            self.previous = frame
+            return None if is_first else mask
+
+        if self.detector == "running_average":
+            if self.background is None:
+                self.background = frame.astype(np.float32)
+                return None
+            diff = cv2.absdiff(frame, cv2.convertScaleAbs(self.background))
+            cv2.accumulateWeighted(frame, self.background, self.background_alpha)
+        else:
+            if self.previous is None:
+                self.previous = frame
+                return None
+            diff = cv2.absdiff(self.previous, frame)
+            self.previous = frame
+
+        return threshold_difference(diff)
+
+
+def threshold_difference(diff: np.ndarray) -> np.ndarray:
+    _, threshold_binary_image = cv2.threshold(diff, 20, 255, cv2.THRESH_BINARY)
+    return threshold_binary_image
+
+
+def scan_motion(
+    video_path: Path,
+    settings: ScanSettings,
+    first_sample: int,
+    last_sample: int,
+    debug=False,
+) -> Iterator[tuple[int, np.ndarray | None]]:
+    # Yields (frame_index, areas) for samples first_sample..last_sample
+    # (inclusive), where sample i is frame i * frame_step. Each sample is
+    # compared against the last sample read before it, so the scan reads the
+    # preceding sample first. areas holds the area of every moving blob, it is
+    # None on read errors.
+    assert first_sample >= 1
+    frame_step = settings.frame_step
+    video_source = open_video_source(video_path, settings.backend)
+
+    # Find the reference sample, walking back over unreadable samples
+    reference_sample = first_sample - 1
+    while True:
+        reference_index = reference_sample * frame_step
+        frame1 = video_source.read(reference_index)
+        if frame1 is not None or reference_sample == 0:
+            break
+        reference_sample -= 1
+    if frame1 is None:
+        logger.error(f"Failed to read reference frame {reference_index}")
+        video_source.release()
+        return
+
+    # A background model needs some history before it is meaningful, a
+    # frame difference only needs the reference sample
+    detector = ForegroundDetector(settings.detector)
+    if settings.detector != "frame_diff":
+        warmup_first = max(reference_sample - settings.warmup_samples, 0)
+        warmup = video_source.read_batch(
+            (frame_step * i for i in range(warmup_first, reference_sample)),
+            settings.decode_mode,
+        )
+        for _, frame in warmup:
+            if frame is not None:
+                detector.apply(preprocess_frame(frame, settings))
+    detector.apply(preprocess_frame(frame1, settings))
+
+    samples = video_source.read_batch(
+        (frame_step * i for i in range(first_sample, last_sample + 1)),
+        settings.decode_mode,
+    )
+    start_time = time.perf_counter()
+
+    was_moving = False
+    for frame_index, frame2 in samples:
+        if frame2 is None:
+            logger.error(f"Error reading frame {frame_index}")
+            yield frame_index, None
+            continue
+
+        frame2 = preprocess_frame(frame2, settings)
+
+        foreground = detector.apply(frame2)
+        assert foreground is not None
+        # dilated = cv2.dilate(foreground, None, iterations=3)
+        dilated = foreground
+
+        if debug:
+            cv2.imshow("foreground", foreground)
+            cv2.imshow("down_scale", frame2)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+
+        # Calculate the total movement
+        if settings.motion_metric == "components":
+            areas = component_areas(dilated)
+        else:
+            areas = contour_areas(dilated)
+        movement = total_movement(areas, settings.min_contour_area_px)
+
+        if debug and movement > 0 and not was_moving:
+            contours, _ = cv2.findContours(
+                dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
+            )
+            # Create a blank image with the same dimensions as the dilated image
+            contour_img = cv2.cvtColor(
+                dilated, cv2.COLOR_GRAY2BGR
+            )  # Convert to BGR to draw colored contours
+            # Draw the contours on the blank image
+            cv2.drawContours(
+                contour_img, contours, -1, (0, 255, 0), 2
+            )  # Green contours with thickness of 2
+            # Display the image with contours
+            cv2.imshow("Contours", contour_img)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
+        was_moving = movement > 0
+
+        yield frame_index, areas
+
+    video_source.release()
+
+    elapsed = time.perf_counter() - start_time
+    decoded_frames = video_source.decoded_frames
+    if elapsed > 0:
+        logger.info(
+            f"{settings.backend} {settings.decode_mode} decoding: {decoded_frames} frames in {pretty_time_delta(elapsed)}, "
+            f"{decoded_frames / elapsed:.1f} decoded fps, "
+            f"{(last_sample - first_sample + 1) / elapsed:.1f} samples/s"
+        )
+
+
+def make_period(start_frame: int, end_frame: int, fps: float) -> dict[str, Any]:
+    return {
+        "start": pretty_time_delta(start_frame / fps),
+        "end": pretty_time_delta(end_frame / fps),
+        "start_frames": start_frame,
+        "end_frames": end_frame,
+    }
+
+
+class MotionSegmenter:
+    # Turns the per-sample movement series into motion periods
+    def __init__(
+        self,
+        fps: float,
+        movement_threshold_px: float,
+        on_period: Callable[[dict[str, Any]], None] | None = None,
+    ) -> None:
+        self.fps = fps
+        self.movement_threshold_px = movement_threshold_px
+        self.on_period = on_period
+        self.motion_periods: list[dict[str, Any]] = []
+        self.motion_start: int | None = None
+        self.frame_index = 0
+        self.total_moving_frame_count = 0
+
+    def get_state(self) -> dict[str, Any]:
+        return {
+            "frame_index": self.frame_index,
+            "motion_start": self.motion_start,
+            "total_moving_frame_count": self.total_moving_frame_count,
+        }
+
+    def set_state(
+        self, state: dict[str, Any], motion_periods: list[dict[str, Any]]
+    ) -> None:
+        self.frame_index = state["frame_index"]
+        self.motion_start = state["motion_start"]
+        self.total_moving_frame_count = state["total_moving_frame_count"]
+        self.motion_periods = motion_periods
+
+    def add_sample(self, frame_index: int, total_movement: float | None) -> None:
+        self.frame_index = frame_index
+        if total_movement is None:
+            return
+
+        # Detect motion start and end times
+        if total_movement > self.movement_threshold_px:
+            self.total_moving_frame_count += 1
+            if (self.total_moving_frame_count % 100) == 0:
+                logger.info(
+                    f"Moving frames: {self.total_moving_frame_count}/{frame_index}"
+                )
+            if self.motion_start is None:
+                self.motion_start = frame_index  # Start a new motion period
+        elif self.motion_start is not None:
+            self.close_period(frame_index)
+
+    def close_period(self, end_frame: int) -> None:
+        assert self.motion_start is not None
+        period = make_period(self.motion_start, end_frame, self.fps)
+        self.motion_periods.append(period)
+        if self.on_period is not None:
+            self.on_period(period)
+        self.motion_start = None  # Reset motion start
+
+    def finish(self) -> list[dict[str, Any]]:
+        # If motion was ongoing at the end of the video
+        if self.motion_start is not None:
+            self.close_period(self.frame_index)
+        return self.motion_periods
+
+
+def refine_motion_periods(
+    video_path: Path,
+    motion_periods: list[dict[str, Any]],
+    settings: ScanSettings,
+    movement_threshold_px: float,
+    fine_step: int,
+    last_frame: int,
+) -> tuple[list[dict[str, Any]], int]:
+    # Moves the boundaries of periods found by a coarse scan to the nearest
+    # fine_step frames. A period starts in the coarse step before its first
+    # moving sample; the start is the first frame that differs from the still
+    # sample before it. The end is the first frame that already looks like the
+    # still end sample. A frame difference also flags the sample where the
+    # movement stops, so its end is searched two steps back. Each boundary is
+    # found with a binary search, assuming the change is monotonic inside the
+    # searched range. Returns the refined periods and the frames decoded.
+    video_source = open_video_source(video_path, settings.backend)
+    frame_step = settings.frame_step
+    fps = video_source.fps
+    frames = {}
+
+    def read_frame(frame_index: int) -> np.ndarray | None:
+        if frame_index not in frames:
+            frame = video_source.read(frame_index)
+            frames[frame_index] = (
+                None if frame is None else preprocess_frame(frame, settings)
+            )
+        return frames[frame_index]
+
+    def is_different(frame_a: np.ndarray, frame_index: int) -> bool | None:
+        frame_b = read_frame(frame_index)
+        if frame_b is None:
+            return None
+        binary_image = threshold_difference(cv2.absdiff(frame_a, frame_b))
+        if settings.motion_metric == "components":
+            areas = component_areas(binary_image)
+        else:
+            areas = contour_areas(binary_image)
+        movement = total_movement(areas, settings.min_contour_area_px)
+        return movement > movement_threshold_px
+
+    def first_frame(
+        after: int, until: int, anchor: np.ndarray, differs: bool
+    ) -> int:
+        # First frame in (after, until] on the fine grid where comparing with
+        # the anchor gives `differs`, until itself is assumed to match
+        candidates = list(range(after + fine_step, until, fine_step)) + [until]
+        low, high = 0, len(candidates) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if is_different(anchor, candidates[middle]) == differs:
+                high = middle
+            else:
+                low = middle + 1
+        return candidates[low]
+
+    end_search_steps = 2 if settings.detector == "frame_diff" else 1
+
+    refined_periods = []
+    for period in motion_periods:
+        start = period["start_frames"]
+        end = period["end_frames"]
+
+        still_before = read_frame(start - frame_step)
+        if still_before is not None:
+            start = first_frame(start - frame_step, start, still_before, True)
+
+        # A period still open at the end of the video has no still sample
+        if end < last_frame:
+            still_after = read_frame(end)
+            if still_after is not None:
+                search_from = max(end - end_search_steps * frame_step, start)
+                end = first_frame(search_from, end, still_after, False)
+
+        refined_periods.append(make_period(start, end, fps))
+        frames.clear()
+
+    video_source.release()
+    return refined_periods, video_source.decoded_frames
+
+
+def _scan_chunk_worker(
+    video_path: Path,
+    settings: ScanSettings,
+    first_sample: int,
+    last_sample: int,
+    progress_queue,
+) -> list[tuple[int, np.ndarray | None]]:
+    progress = _QueueProgress(progress_queue)
+    samples = []
+    for sample in scan_motion(video_path, settings, first_sample, last_sample):
+        samples.append(sample)
+        progress(1)
+    progress.flush()
+    return samples
+
+
+def _scan_chunks(
+    video_path: Path,
+    settings: ScanSettings,
+    first_sample: int,
+    last_sample: int,
+    workers: int,
+    progress_callback: Callable[[int], None],
+) -> Iterator[tuple[int, np.ndarray | None]]:
+    # Scans contiguous ranges of samples in worker processes and yields the
+    # samples in video order as soon as all earlier chunks are done
+    chunk_count = min(workers * 4, last_sample - first_sample + 1)
+    bounds = np.linspace(first_sample, last_sample + 1, chunk_count + 1).astype(int)
+
+    mp_context = multiprocessing.get_context("spawn")
+    with mp_context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=init_batch_worker,
+        initargs=(1,),
+    ) as executor:
+        progress_queue = manager.Queue()
+        futures = [
+            executor.submit(
+                _scan_chunk_worker,
+                video_path,
+                settings,
+                first,
+                last - 1,
+                progress_queue,
+            )
+            for first, last in zip(bounds[:-1], bounds[1:])
+            if last > first
+        ]
+
+        for future in futures:
+            while True:
+                _drain_progress(progress_queue, progress_callback)
+                try:
+                    samples = future.result(timeout=0.2)
+                    break
+                except TimeoutError:
+                    continue
+            yield from samples
+        _drain_progress(progress_queue, progress_callback)
+
 
 def detect_motion(
     video_path: Path,
@@ -20,14 +491,29 @@ def detect_motion(
     cut_bottom=None,
     cut_right=None,
     cut_left=None,
+    decode_mode="auto",
+    progress_callback: Callable[[int], None] | None = None,
+    workers=1,
+    checkpoint_interval=100,
+    motion_metric="contours",
+    save_output=True,
+    analysis_width: int | None = None,
+    backend="opencv",
+    detector="frame_diff",
+    refine_step_sec: float | None = None,
 ):
     logger.info(f"Loading {str(video_path)}")
     assert video_path.exists()
+    assert decode_mode in DECODE_MODES
+    assert motion_metric in MOTION_METRICS
+    assert backend in VIDEO_BACKENDS
+    assert detector in DETECTORS
+    assert not (debug and workers > 1)
 
     # Open the video file
-    video_reader = cv2.VideoCapture(str(video_path))
-    frame_count = int(video_reader.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = video_reader.get(cv2.CAP_PROP_FPS)
+    video_source = open_video_source(video_path, backend)
+    frame_count = video_source.frame_count
+    fps = video_source.fps
 
     frame_step = int(
         fps * step_sec
@@ -35,13 +521,18 @@ def detect_motion(
 
     iter_count = frame_count // frame_step
 
-    motion_periods = []
+    if decode_mode == "auto" and backend == "opencv":
+        keyframe_interval = estimate_keyframe_interval(video_path)
+        decode_mode = choose_decode_mode(frame_step, keyframe_interval)
+        logger.info(
+            f"Keyframe interval {keyframe_interval}, frame step {frame_step}: using {decode_mode} decoding"
+        )
 
-    ret, frame1 = video_reader.read()
-    if not ret:
+    frame1 = video_source.read(0)
+    video_source.release()
+    if frame1 is None:
         logger.error("Failed to read first frame, aborting video")
-        return
-    frame_index = 0
+        return None
 
     height = frame1.shape[0]
     width = frame1.shape[1]
@@ -49,128 +540,282 @@ def detect_motion(
         f"Original size ({width},{height}), {pretty_time_delta(frame_count/fps)}"
     )
 
-    # crop_x = int(cut_left / 100 * width if cut_left else 0)
-    # crop_y = int(cut_top / 100 * height if cut_top else 0)
-    # crop_xx = width - int(cut_right / 100 * width if cut_right else 0)
-    # crop_yy = height - int(cut_bottom / 100 * height if cut_bottom else 0)
-
-    def frame_preprocess(frame):
-        # frame = frame[crop_x:crop_xx, crop_y:crop_yy]
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        down_scale = cv2.resize(gray, (0, 0), fx=0.5, fy=0.5)
-        return down_scale
-
-    frame1 = frame_preprocess(frame1)
-
-    height = frame1.shape[0]
-    width = frame1.shape[1]
+    crop = get_crop(width, height, cut_top, cut_bottom, cut_right, cut_left)
+    width, height = get_analysis_size(crop, analysis_width)
     logger.info(
-        f"Subsampled size ({width},{height}), {pretty_time_delta((frame_count/frame_step)/fps)}"
+        f"Analysis region {crop}, subsampled size ({width},{height}), {pretty_time_delta((frame_count/frame_step)/fps)}"
     )
 
     movement_threshold_px = movement_threshold * width * height
+    settings = ScanSettings(
+        frame_step=frame_step,
+        min_contour_area_px=min_contour_area * width * height,
+        crop=crop,
+        analysis_size=(width, height),
+        decode_mode=decode_mode,
+        motion_metric=motion_metric,
+        backend=backend,
+        detector=detector,
+    )
+    params = {
+        "frame_count": frame_count,
+        "frame_step": frame_step,
+        "movement_threshold": movement_threshold,
+        "min_contour_area": min_contour_area,
+        "cut": [cut_top, cut_bottom, cut_right, cut_left],
+        "analysis_size": [width, height],
+        "motion_metric": motion_metric,
+        "detector": detector,
+    }
+
+    segmenter = MotionSegmenter(fps, movement_threshold_px)
+    # Blob areas of every sample, kept so thresholds can be tuned later
+    sample_areas: list[np.ndarray | None] = []
+    first_sample = 1
+    checkpoint = None
+    if save_output:
+        # Resume from the last checkpoint if the scan was interrupted
+        checkpoint = MotionCheckpoint(video_path, params)
+        resume = checkpoint.load()
+        if resume is not None:
+            state, motion_periods, sample_areas = resume
+            segmenter.set_state(state, motion_periods)
+            first_sample = segmenter.frame_index // frame_step + 1
+            assert len(sample_areas) == first_sample - 1
+            logger.info(
+                f"Resuming from frame {segmenter.frame_index}, {len(segmenter.motion_periods)} motion periods found"
+            )
+        checkpoint.start(
+            segmenter.get_state(), segmenter.motion_periods, sample_areas
+        )
+        segmenter.on_period = checkpoint.add_period
+    saved_sample_count = len(sample_areas)
+
+    with tqdm(total=iter_count, disable=progress_callback is not None) as progress_bar:
+        if progress_callback is None:
+            progress_callback = progress_bar.update
+        progress_callback(first_sample - 1)
+
+        if first_sample > iter_count:
+            samples = iter([])
+        elif workers > 1 and iter_count - first_sample > 0:
+            samples = _scan_chunks(
+                video_path,
+                settings,
+                first_sample,
+                iter_count,
+                workers,
+                progress_callback,
+            )
+        else:
+            samples = scan_motion(
+                video_path, settings, first_sample, iter_count, debug
+            )
+
+        for sample_count, (frame_index, areas) in enumerate(samples, 1):
+            if workers <= 1:
+                progress_callback(1)
+            segmenter.add_sample(
+                frame_index, total_movement(areas, settings.min_contour_area_px)
+            )
+            sample_areas.append(areas)
+            if checkpoint is not None and sample_count % checkpoint_interval == 0:
+                checkpoint.save(
+                    segmenter.get_state(), sample_areas[saved_sample_count:]
+                )
+                saved_sample_count = len(sample_areas)
+
+    motion_periods = segmenter.finish()
+
+    if refine_step_sec:
+        # Second level: search the boundaries at a finer step
+        fine_step = max(int(fps * refine_step_sec), 1)
+        motion_periods, decoded_frames = refine_motion_periods(
+            video_path,
+            motion_periods,
+            settings,
+            movement_threshold_px,
+            fine_step,
+            last_frame=iter_count * frame_step,
+        )
+        logger.info(
+            f"Refined {len(motion_periods)} motion periods to {fine_step} frames, "
+            f"decoded {iter_count + decoded_frames} frames, a uniform scan at that step "
+            f"decodes {frame_count // fine_step}"
+        )
+
+    if checkpoint is not None:
+        save_motion_scores(
+            video_path,
+            fps,
+            frame_step,
+            sample_areas,
+            params,
+            refine_step_sec=refine_step_sec,
+            crop=crop,
+            backend=backend,
+        )
+
+        # Save the motion periods to a JSON file, readers never see a partial file
+        output_json = get_motion_json_path(video_path)
+        checkpoint.finalize(output_json, motion_periods)
+        print(f"Motion detection complete. Motion periods saved to {output_json}")
+    return motion_periods
+
+
+def resegment_motion(
+    video_path: Path,
+    movement_threshold=0.01,
+    min_contour_area=0.001,
+    save_output=True,
+    refine=False,
+) -> list[dict[str, Any]] | None:
+    # Rebuilds the motion periods from the stored scores without decoding the
+    # video, the boundaries are on the coarse scan step. With refine, the
+    # boundaries of a scan that was refined are refined again, which decodes
+    # the frames around them. Returns None if there are no valid scores for
+    # the video.
+    scores = load_motion_scores(video_path)
+    if scores is None:
+        return None
+
+    width, height = scores.analysis_size
     min_contour_area_px = min_contour_area * width * height
+    movement_threshold_px = movement_threshold * width * height
+    movements = sample_movements(scores, min_contour_area_px)
 
-    motion_start_str = None
-    motion_start = None
-    total_moving_frame_count = 0
+    segmenter = MotionSegmenter(scores.fps, movement_threshold_px)
+    for sample, movement in enumerate(movements.tolist(), 1):
+        segmenter.add_sample(
+            sample * scores.frame_step, None if np.isnan(movement) else movement
+        )
+    motion_periods = segmenter.finish()
+
+    if refine and scores.refine_step_sec and scores.crop is not None:
+        # Same second level as the scan
+        settings = ScanSettings(
+            frame_step=scores.frame_step,
+            min_contour_area_px=min_contour_area_px,
+            crop=scores.crop,
+            analysis_size=scores.analysis_size,
+            motion_metric=scores.key["motion_metric"],
+            backend=scores.backend,
+            detector=scores.key["detector"],
+        )
+        motion_periods, _ = refine_motion_periods(
+            video_path,
+            motion_periods,
+            settings,
+            movement_threshold_px,
+            max(int(scores.fps * scores.refine_step_sec), 1),
+            last_frame=len(scores.valid) * scores.frame_step,
+        )
 
-    for _ in tqdm(range(iter_count)):
-        frame_index += frame_step
+    if save_output:
+        write_json_atomic(get_motion_json_path(video_path), motion_periods)
+    return motion_periods
 
-        # Skip to the next frame after the desired interval
-        video_reader.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-        ret, frame2 = video_reader.read()
-        if not ret:
-            logger.error("Error reading frame {frame_index}")
-            continue
 
-        frame2 = frame_preprocess(frame2)
+def count_samples(video_path: Path, step_sec=3) -> int:
+    video_source = open_video_source(video_path)
+    video_source.release()
+    frame_step = int(video_source.fps * step_sec)
+    return video_source.frame_count // frame_step if frame_step > 0 else 0
 
-        diff = cv2.absdiff(frame1, frame2)
-        _, threshold_binary_image = cv2.threshold(diff, 20, 255, cv2.THRESH_BINARY)
-        # dilated = cv2.dilate(threshold_binary_image, None, iterations=3)
-        dilated = threshold_binary_image
 
-        if debug:
-            cv2.imshow("diff", diff)
-            cv2.imshow("down_scale1", frame1)
-            cv2.imshow("down_scale2", frame2)
-            cv2.waitKey(0)
-            cv2.destroyAllWindows()
+@dataclass
+class BatchResult:
+    motion_periods: dict[Path, list[dict[str, Any]]] = field(default_factory=dict)
+    errors: dict[Path, str] = field(default_factory=dict)
 
-        # Find contours
-        contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
-        # Calculate the total movement
-        total_movement = sum(
-            cv2.contourArea(c)
-            for c in contours
-            if cv2.contourArea(c) > min_contour_area_px
-        )
+class _QueueProgress:
+    # Forwards sample progress from a worker to the parent, a few samples at a
+    # time to keep the IPC traffic low
+    def __init__(self, progress_queue, report_every: int = 20) -> None:
+        self.progress_queue = progress_queue
+        self.report_every = report_every
+        self.pending = 0
 
-        # Convert frame count to timestamp
-        timestamp = frame_index / fps
-        timestamp_str = pretty_time_delta(timestamp)
+    def __call__(self, count: int) -> None:
+        self.pending += count
+        if self.pending >= self.report_every:
+            self.flush()
 
-        # Detect motion start and end times
-        if total_movement > movement_threshold_px:
-            total_moving_frame_count += 1
-            if (total_moving_frame_count % 100) == 0:
-                logger.info(f"Moving frames: {total_moving_frame_count}/{frame_index}")
-            if motion_start_str is None:
-                motion_start_str = timestamp_str  # Start a new motion period
-                motion_start = frame_index  # Start a new motion period
-
-                if debug:
-                    # Create a blank image with the same dimensions as the dilated image
-                    contour_img = cv2.cvtColor(
-                        dilated, cv2.COLOR_GRAY2BGR
-                    )  # Convert to BGR to draw colored contours
-                    # Draw the contours on the blank image
-                    cv2.drawContours(
-                        contour_img, contours, -1, (0, 255, 0), 2
-                    )  # Green contours with thickness of 2
-                    # Display the image with contours
-                    cv2.imshow("Contours", contour_img)
-                    cv2.imshow("down_scale1", frame1)
-                    cv2.imshow("frame1", frame1)
-                    cv2.waitKey(0)
-                    cv2.destroyAllWindows()
-        else:
-            if motion_start_str is not None:
-                motion_periods.append(
-                    {
-                        "start": motion_start_str,
-                        "end": timestamp_str,
-                        "start_frames": motion_start,
-                        "end_frames": frame_index,
-                    }
-                )
-                motion_start_str = None  # Reset motion start
-                motion_start = None
-
-        # Update the frame and frame count
-        frame1 = frame2
-
-    # If motion was ongoing at the end of the video
-    if motion_start_str is not None:
-        timestamp = frame_index / fps
-        motion_periods.append(
-            {
-                "start": motion_start_str,
-                "end": pretty_time_delta(timestamp),
-                "start_frames": motion_start,
-                "end_frames": frame_index,
-            }
-        )
+    def flush(self) -> None:
+        if self.pending > 0:
+            self.progress_queue.put(self.pending)
+            self.pending = 0
+
+
+def _drain_progress(progress_queue, progress_callback: Callable[[int], None]) -> None:
+    try:
+        while True:
+            progress_callback(progress_queue.get_nowait())
+    except Empty:
+        pass
 
-    # Save the motion periods to a JSON file
-    output_json = video_path.with_suffix(".json")
-    with open(output_json, "w") as f:
-        json.dump(motion_periods, f, indent=4)
 
-    print(f"Motion detection complete. Motion periods saved to {output_json}")
+def _detect_motion_worker(
+    video_path: Path, progress_queue, detect_kwargs: dict[str, Any]
+) -> list[dict[str, Any]]:
+    progress = _QueueProgress(progress_queue)
+    motion_periods = detect_motion(
+        video_path, progress_callback=progress, **detect_kwargs
+    )
+    progress.flush()
+    if motion_periods is None:
+        raise RuntimeError("Failed to read first frame")
+    return motion_periods
+
+
+def detect_motion_batch(
+    video_files: list[Path],
+    workers: int | None = None,
+    opencv_threads: int = 1,
+    progress_file: TextIO | None = None,
+    **detect_kwargs,
+) -> BatchResult:
+    workers = workers or os.cpu_count() or 1
+    result = BatchResult()
+
+    total_samples = sum(
+        count_samples(video_file, detect_kwargs.get("step_sec", 3))
+        for video_file in video_files
+    )
+
+    # Spawn keeps the workers independent of the parent's Qt and OpenCV state
+    mp_context = multiprocessing.get_context("spawn")
+    with mp_context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=init_batch_worker,
+        initargs=(opencv_threads,),
+    ) as executor, tqdm(total=total_samples, file=progress_file) as progress_bar:
+        progress_queue = manager.Queue()
+        pending = {
+            executor.submit(
+                _detect_motion_worker, video_file, progress_queue, detect_kwargs
+            ): video_file
+            for video_file in video_files
+        }
+
+        while pending:
+            done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            _drain_progress(progress_queue, progress_bar.update)
+            for future in done:
+                video_file = pending.pop(future)
+                try:
+                    result.motion_periods[video_file] = future.result()
+                except Exception as e:
+                    logger.error(f"Motion detection failed for {str(video_file)}: {e}")
+                    result.errors[video_file] = str(e)
+                progress_bar.set_postfix(
+                    files=f"{len(video_files) - len(pending)}/{len(video_files)}"
+                )
+        _drain_progress(progress_queue, progress_bar.update)
+
+    return result
 
 
 def main() -> None:
@@ -182,8 +827,9 @@ def main() -> None:
     if len(video_files) == 0:
         print("No Videos found!")
 
-    for file in video_files:
-        detect_motion(file)
+    result = detect_motion_batch(video_files)
+    for file, error in result.errors.items():
+        print(f"Failed {str(file)}: {error}")
 
 
 if __name__ == "__main__":
@@ -1,19 +1,27 @@
+import os
 from pathlib import Path
 
 from PySide6.QtGui import QColor
-from tqdm import tqdm
 from PySide6.QtWidgets import (
     QApplication,
+    QCheckBox,
+    QComboBox,
+    QDoubleSpinBox,
     QVBoxLayout,
+    QHBoxLayout,
+    QLabel,
     QPushButton,
     QMessageBox,
+    QSpinBox,
     QWidget,
     QListWidget,
     QTextEdit,
     QListWidgetItem,
 )
 
-from motion_detector import detect_motion
+from motion_checkpoint import get_motion_json_path, get_partial_json_path
+from motion_detector import DETECTORS, detect_motion_batch, resegment_motion
+from video_proxy import generate_proxies_batch, load_video_proxy
 
 
 class MotionDetectorUi(QWidget):
@@ -36,11 +44,90 @@ class MotionDetectorUi(QWidget):
         self.file_list = QListWidget()
         layout.addWidget(self.file_list)
 
+        # Number of videos processed in parallel
+        workers_layout = QHBoxLayout()
+        self.workers_spinbox = self.add_spinbox(
+            workers_layout, "Parallel workers:", 1, os.cpu_count() or 1
+        )
+        self.workers_spinbox.setValue(os.cpu_count() or 1)
+        layout.addLayout(workers_layout)
+
+        # Region of interest, as a percentage cut from each side of the frame
+        roi_layout = QHBoxLayout()
+        self.cut_spinboxes = {
+            side: self.add_spinbox(roi_layout, f"Cut {side} %:", 0, 90)
+            for side in ["top", "bottom", "left", "right"]
+        }
+        layout.addLayout(roi_layout)
+
+        # Width the region is scaled to before analysis, 0 for half resolution
+        analysis_layout = QHBoxLayout()
+        self.analysis_width_spinbox = self.add_spinbox(
+            analysis_layout, "Analysis width px:", 0, 4096
+        )
+        self.analysis_width_spinbox.setValue(320)
+
+        # Frame differencing or a background model
+        analysis_layout.addWidget(QLabel("Detector:"))
+        self.detector_dropdown = QComboBox()
+        self.detector_dropdown.addItems(DETECTORS)
+        analysis_layout.addWidget(self.detector_dropdown)
+        layout.addLayout(analysis_layout)
+
+        # Thresholds, as a percentage of the analysed region
+        threshold_layout = QHBoxLayout()
+        threshold_layout.addWidget(QLabel("Movement threshold %:"))
+        self.movement_threshold_spinbox = QDoubleSpinBox()
+        self.movement_threshold_spinbox.setDecimals(3)
+        self.movement_threshold_spinbox.setValue(1.0)
+        threshold_layout.addWidget(self.movement_threshold_spinbox)
+        threshold_layout.addWidget(QLabel("Min blob area %:"))
+        self.min_contour_area_spinbox = QDoubleSpinBox()
+        self.min_contour_area_spinbox.setDecimals(3)
+        self.min_contour_area_spinbox.setValue(0.1)
+        threshold_layout.addWidget(self.min_contour_area_spinbox)
+
+        # Second pass around period boundaries, 0 to keep the coarse boundaries
+        threshold_layout.addWidget(QLabel("Refine boundaries to s:"))
+        self.refine_step_spinbox = QDoubleSpinBox()
+        self.refine_step_spinbox.setDecimals(2)
+        self.refine_step_spinbox.setValue(0.25)
+        threshold_layout.addWidget(self.refine_step_spinbox)
+        layout.addLayout(threshold_layout)
+
         # Button to process missing files
         self.process_button = QPushButton("Process All Missing Files")
         self.process_button.clicked.connect(self.process_missing_files)
         layout.addWidget(self.process_button)
 
+        # Button to apply new thresholds to the stored scores. Without decoding
+        # the boundaries are on the scan step, refining them again decodes the
+        # frames around each one.
+        rethreshold_layout = QHBoxLayout()
+        self.rethreshold_button = QPushButton("Re-threshold All Processed Files")
+        self.rethreshold_button.clicked.connect(self.rethreshold_files)
+        rethreshold_layout.addWidget(self.rethreshold_button)
+        self.refine_again_checkbox = QCheckBox("Refine boundaries again (decodes)")
+        rethreshold_layout.addWidget(self.refine_again_checkbox)
+        layout.addLayout(rethreshold_layout)
+
+        # Thumbnails the viewer shows while the slider is dragged
+        proxy_layout = QHBoxLayout()
+        self.proxy_width_spinbox = self.add_spinbox(
+            proxy_layout, "Proxy width px:", 64, 1920
+        )
+        self.proxy_width_spinbox.setValue(320)
+        proxy_layout.addWidget(QLabel("Proxy step s:"))
+        self.proxy_step_spinbox = QDoubleSpinBox()
+        self.proxy_step_spinbox.setDecimals(2)
+        self.proxy_step_spinbox.setRange(0.01, 60)
+        self.proxy_step_spinbox.setValue(0.25)
+        proxy_layout.addWidget(self.proxy_step_spinbox)
+        self.proxy_button = QPushButton("Generate Missing Scrubbing Proxies")
+        self.proxy_button.clicked.connect(self.generate_missing_proxies)
+        proxy_layout.addWidget(self.proxy_button)
+        layout.addLayout(proxy_layout)
+
         # Console output for tqdm progress
         self.console_output = QTextEdit()
         self.console_output.setReadOnly(True)
@@ -53,12 +140,27 @@ class MotionDetectorUi(QWidget):
         self.setLayout(layout)
         self.resize(600, 400)
 
+    def add_spinbox(
+        self, layout: QHBoxLayout, label: str, minimum: int, maximum: int
+    ) -> QSpinBox:
+        layout.addWidget(QLabel(label))
+        spinbox = QSpinBox()
+        spinbox.setRange(minimum, maximum)
+        layout.addWidget(spinbox)
+        return spinbox
+
     def populate_file_list(self):
+        self.file_list.clear()
         for video_file in self.video_files_:
-            json_file = video_file.with_suffix(".json")
-            item = QListWidgetItem(video_file.name)
+            json_file = get_motion_json_path(video_file)
+            name = video_file.name
+            if load_video_proxy(video_file) is not None:
+                name += " (proxy)"
+            item = QListWidgetItem(name)
             if json_file.exists():
                 item.setBackground(QColor("green"))  # Green if .json exists
+            elif get_partial_json_path(video_file).exists():
+                item.setBackground(QColor("orange"))  # Interrupted, will resume
             else:
                 item.setBackground(QColor("red"))  # Red if .json is missing
             self.file_list.addItem(item)
@@ -67,7 +169,7 @@ class MotionDetectorUi(QWidget):
         missing_files = [
             video_file
             for video_file in self.video_files_
-            if not video_file.with_suffix(".json").exists()
+            if not get_motion_json_path(video_file).exists()
         ]
 
         if not missing_files:
@@ -75,8 +177,72 @@ class MotionDetectorUi(QWidget):
             return
 
         self.console_output.clear()
-        for video_file in tqdm(missing_files, file=self.get_console_writer()):
-            detect_motion(video_file)
+        self.process_button.setEnabled(False)
+        result = detect_motion_batch(
+            missing_files,
+            workers=self.workers_spinbox.value(),
+            progress_file=self.get_console_writer(),
+            cut_top=self.cut_spinboxes["top"].value(),
+            cut_bottom=self.cut_spinboxes["bottom"].value(),
+            cut_left=self.cut_spinboxes["left"].value(),
+            cut_right=self.cut_spinboxes["right"].value(),
+            analysis_width=self.analysis_width_spinbox.value(),
+            detector=self.detector_dropdown.currentText(),
+            movement_threshold=self.movement_threshold_spinbox.value() / 100,
+            min_contour_area=self.min_contour_area_spinbox.value() / 100,
+            refine_step_sec=self.refine_step_spinbox.value(),
+        )
+        self.process_button.setEnabled(True)
+
+        for video_file, error in result.errors.items():
+            self.console_output.append(f"Failed {video_file.name}: {error}")
+        self.populate_file_list()
+
+    def generate_missing_proxies(self):
+        missing_files = [
+            video_file
+            for video_file in self.video_files_
+            if load_video_proxy(video_file) is None
+        ]
+        if not missing_files:
+            QMessageBox.information(self, "Info", "All files have a proxy.")
+            return
+
+        self.console_output.clear()
+        self.proxy_button.setEnabled(False)
+        errors = generate_proxies_batch(
+            missing_files,
+            workers=self.workers_spinbox.value(),
+            progress_file=self.get_console_writer(),
+            width=self.proxy_width_spinbox.value(),
+            step_sec=self.proxy_step_spinbox.value(),
+        )
+        self.proxy_button.setEnabled(True)
+
+        for video_file, error in errors.items():
+            self.console_output.append(f"Failed {video_file.name}: {error}")
+        self.populate_file_list()
+
+    def rethreshold_files(self):
+        # Only reads the stored scores unless the boundaries are refined again
+        self.console_output.clear()
+        refine = self.refine_again_checkbox.isChecked()
+        for video_file in self.video_files_:
+            motion_periods = resegment_motion(
+                video_file,
+                movement_threshold=self.movement_threshold_spinbox.value() / 100,
+                min_contour_area=self.min_contour_area_spinbox.value() / 100,
+                refine=refine,
+            )
+            if motion_periods is None:
+                self.console_output.append(f"No scores for {video_file.name}")
+            else:
+                self.console_output.append(
+                    f"{video_file.name}: {len(motion_periods)} motion periods"
+                )
+            if refine:
+                QApplication.processEvents()  # Show the progress
+        self.populate_file_list()
 
     def get_console_writer(self):
         # Writer for tqdm to write into the QTextEdit
@@ -0,0 +1,124 @@
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from utils import get_video_key
+
+# Parameters that only affect the segmentation, they can change without
+# invalidating the stored scores
+SEGMENTATION_PARAMS = ("movement_threshold", "min_contour_area")
+
+
+def get_scores_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".scores.npz")
+
+
+def get_scores_key(video_path: Path, params: dict[str, Any]) -> dict[str, Any]:
+    # The scores are valid for this exact file and these scan parameters
+    key = {k: v for k, v in params.items() if k not in SEGMENTATION_PARAMS}
+    key.update(get_video_key(video_path))
+    # Round trip so the comparison with the loaded key is exact
+    return json.loads(json.dumps(key))
+
+
+@dataclass
+class MotionScores:
+    # Blob areas of every sample in analysis pixels, stored back to back.
+    # Sample i covers areas[offsets[i]:offsets[i + 1]] and is frame
+    # (i + 1) * frame_step. valid[i] is False if the sample could not be read.
+    areas: np.ndarray
+    offsets: np.ndarray
+    valid: np.ndarray
+    fps: float
+    frame_step: int
+    analysis_size: tuple[int, int]
+    key: dict[str, Any]
+    # Set if the periods were refined after the scan, a re-threshold refines
+    # them again with the same step, crop and backend
+    refine_step_sec: float | None = None
+    crop: tuple[int, int, int, int] | None = None
+    backend: str = "opencv"
+
+
+def save_motion_scores(
+    video_path: Path,
+    fps: float,
+    frame_step: int,
+    sample_areas: list[np.ndarray | None],
+    params: dict[str, Any],
+    refine_step_sec: float | None = None,
+    crop: tuple[int, int, int, int] | None = None,
+    backend: str = "opencv",
+) -> None:
+    counts = [0 if areas is None else len(areas) for areas in sample_areas]
+    valid_areas = [areas for areas in sample_areas if areas is not None]
+    scores_path = get_scores_path(video_path)
+    tmp_path = scores_path.with_name(scores_path.name + ".tmp.npz")
+    np.savez(
+        tmp_path,
+        areas=np.concatenate([np.zeros(0, dtype=np.float32)] + valid_areas),
+        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        valid=np.array([areas is not None for areas in sample_areas], dtype=bool),
+        fps=fps,
+        frame_step=frame_step,
+        analysis_size=np.array(params["analysis_size"]),
+        key=json.dumps(get_scores_key(video_path, params)),
+        refine=json.dumps(
+            {"step_sec": refine_step_sec, "crop": crop, "backend": backend}
+        ),
+    )
+    os.replace(tmp_path, scores_path)
+
+
+def load_motion_scores(
+    video_path: Path, params: dict[str, Any] | None = None
+) -> MotionScores | None:
+    # Returns None if there are no scores or they are stale. Without params
+    # only the video file is checked.
+    scores_path = get_scores_path(video_path)
+    if not scores_path.exists():
+        return None
+
+    with np.load(scores_path) as data:
+        scores = MotionScores(
+            areas=data["areas"],
+            offsets=data["offsets"],
+            valid=data["valid"],
+            fps=float(data["fps"]),
+            frame_step=int(data["frame_step"]),
+            analysis_size=tuple(data["analysis_size"].tolist()),
+            key=json.loads(str(data["key"])),
+        )
+        # Scores saved before refinement was recorded have no refine entry
+        if "refine" in data.files:
+            refine = json.loads(str(data["refine"]))
+            scores.refine_step_sec = refine["step_sec"]
+            scores.crop = None if refine["crop"] is None else tuple(refine["crop"])
+            scores.backend = refine["backend"]
+
+    video_key = get_video_key(video_path)
+    if any(scores.key.get(k) != v for k, v in video_key.items()):
+        return None
+    if params is not None and scores.key != get_scores_key(video_path, params):
+        return None
+    return scores
+
+
+def sample_movements(scores: MotionScores, min_area_px: float) -> np.ndarray:
+    # Total movement per sample from blobs larger than min_area_px, NaN for
+    # unreadable samples. The areas are whole or half pixels, so the sums match
+    # the ones computed during the scan exactly.
+    sample_count = len(scores.valid)
+    sample_ids = np.repeat(np.arange(sample_count), np.diff(scores.offsets))
+    keep = scores.areas > min_area_px
+    movements = np.bincount(
+        sample_ids[keep],
+        weights=scores.areas[keep].astype(np.float64),
+        minlength=sample_count,
+    )
+    movements[~scores.valid] = np.nan
+    return movements
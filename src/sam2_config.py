@@ -0,0 +1,17 @@
+from pathlib import Path
+
+# Kept apart from sam2_processor so the options can be listed without
+# importing torch
+
+# Model tiers, smallest first: (config, checkpoint file)
+SAM2_MODELS = {
+    "tiny": ("sam2_hiera_t.yaml", "sam2_hiera_tiny.pt"),
+    "small": ("sam2_hiera_s.yaml", "sam2_hiera_small.pt"),
+    "base+": ("sam2_hiera_b+.yaml", "sam2_hiera_base_plus.pt"),
+    "large": ("sam2_hiera_l.yaml", "sam2_hiera_large.pt"),
+}
+SAM2_CHECKPOINT_DIR = Path("sam2_repo/checkpoints")
+
+# "quantize" converts the linear layers to dynamic int8, "compile" runs the
+# image encoder through torch.compile. Both are meant for CPU inference.
+SAM2_OPTIMIZATIONS = ("none", "quantize", "compile")
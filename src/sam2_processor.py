@@ -1,11 +1,49 @@
+from dataclasses import dataclass
+from pathlib import Path
+
 import numpy as np
 import torch
 from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 
+from embedding_cache import (
+    EmbeddingCache,
+    ImageEmbedding,
+    get_predictor_embedding,
+    set_predictor_embedding,
+)
+from embedding_store import EmbeddingStore, get_model_key
+from sam2_config import SAM2_CHECKPOINT_DIR, SAM2_MODELS, SAM2_OPTIMIZATIONS
+
+
+@dataclass
+class Prompt:
+    positive: np.ndarray  # [point, coords]
+    negative: np.ndarray  # [point, coords]
+    # [256, 256] low resolution logits of the previous mask of the record, the
+    # decoder refines that mask instead of starting over
+    mask_logits: np.ndarray | None = None
+
 
 class Sam2Processor:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        model: str = "large",
+        num_threads: int | None = None,
+        optimization: str = "none",
+        checkpoint_dir: Path | None = SAM2_CHECKPOINT_DIR,
+        embedding_cache_bytes: int = 1024**3,
+        use_embedding_store: bool = True,
+    ) -> None:
+        # checkpoint_dir None builds the model with random weights, only for
+        # timing
+        assert model in SAM2_MODELS
+        assert optimization in SAM2_OPTIMIZATIONS
+
+        if num_threads is not None:
+            # Intra-op threads, torch defaults to the number of physical cores
+            torch.set_num_threads(num_threads)
+
         if torch.cuda.is_available():
             self.device_ = torch.device("cuda")
         elif torch.backends.mps.is_available():
@@ -31,26 +69,167 @@ class Sam2Processor:
 
         print("Using sam2 device type: " + self.device_.type)
 
-        sam2_checkpoint = "sam2_repo/checkpoints/sam2_hiera_large.pt"
-        model_cfg = "sam2_hiera_l.yaml"
+        self.model_ = model
+        self.checkpoint_dir_ = checkpoint_dir
+        model_cfg, checkpoint_name = SAM2_MODELS[model]
+        sam2_checkpoint = (
+            None if checkpoint_dir is None else checkpoint_dir / checkpoint_name
+        )
+        print(
+            f"Sam2 model: {model}, {torch.get_num_threads()} threads, "
+            f"optimization: {optimization}"
+        )
 
-        sam2_model = build_sam2(model_cfg, sam2_checkpoint, device=self.device_)
+        sam2_model = build_sam2(
+            model_cfg,
+            None if sam2_checkpoint is None else str(sam2_checkpoint),
+            device=self.device_,
+        )
+        if optimization == "quantize" and self.device_.type == "cpu":
+            # Weights to int8, activations are quantized on the fly. Dynamic
+            # quantization only has CPU kernels.
+            sam2_model = torch.ao.quantization.quantize_dynamic(
+                sam2_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif optimization == "compile":
+            # Compiled on the first image, which takes a while
+            sam2_model.image_encoder = torch.compile(sam2_model.image_encoder)
         self.predictor_ = SAM2ImagePredictor(sam2_model)
 
+        # Image features by frame, so a frame is only encoded once. They are
+        # also kept on disk next to the video, for the next session.
+        self.embedding_cache_ = EmbeddingCache(embedding_cache_bytes)
+        self.model_key_ = get_model_key(
+            model_cfg, sam2_checkpoint or Path("random"), optimization
+        )
+        self.use_embedding_store_ = use_embedding_store
+        self.embedding_store_: EmbeddingStore | None = None
+
+    def get_embedding_store(self, video_path: Path) -> EmbeddingStore:
+        # Only the store of the current video is kept open
+        store = self.embedding_store_
+        if store is None or store.video_path != video_path:
+            self.embedding_store_ = EmbeddingStore(video_path, self.model_key_)
+        return self.embedding_store_
+
+    def load_embedding(self, image_key: tuple[str, int] | None) -> ImageEmbedding | None:
+        # From memory, then from the store on disk
+        if image_key is None:
+            return None
+        embedding = self.embedding_cache_.get(image_key)
+        if embedding is None and self.use_embedding_store_:
+            video_path, frame_index = Path(image_key[0]), image_key[1]
+            embedding = self.get_embedding_store(video_path).load(
+                frame_index, self.device_, torch.float32
+            )
+            if embedding is not None:
+                self.embedding_cache_.put(image_key, embedding)
+        return embedding
+
+    def save_embedding(
+        self, image_key: tuple[str, int] | None, embedding: ImageEmbedding
+    ) -> None:
+        if image_key is None:
+            return
+        self.embedding_cache_.put(image_key, embedding)
+        if self.use_embedding_store_:
+            video_path, frame_index = Path(image_key[0]), image_key[1]
+            self.get_embedding_store(video_path).save(frame_index, embedding)
+
+    def get_embeddings(
+        self, images: list[np.ndarray], image_keys: list[tuple[str, int] | None]
+    ) -> list[ImageEmbedding]:
+        # image_keys are the (video path, frame index) from get_embedding_key,
+        # None disables caching for that image
+        embeddings = [self.load_embedding(image_key) for image_key in image_keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        # One encoder pass over all the images not cached yet
+        if len(missing) == 1:
+            self.predictor_.set_image(images[missing[0]])
+        elif len(missing) > 1:
+            self.predictor_.set_image_batch([images[i] for i in missing])
+        for batch_index, i in enumerate(missing):
+            embedding = get_predictor_embedding(self.predictor_, batch_index)
+            self.save_embedding(image_keys[i], embedding)
+            embeddings[i] = embedding
+        return embeddings
+
+    def predict_masks(
+        self, embedding: ImageEmbedding, prompts: list[Prompt]
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        # The best mask and its low resolution logits for every prompt of an
+        # image. New prompts pick the best of three masks. Prompts with previous
+        # logits are not ambiguous, a single refined mask is asked for them.
+        # Each group is one decoder pass.
+        set_predictor_embedding(self.predictor_, embedding)
+        results: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        for refine in [False, True]:
+            indices = [
+                i
+                for i, prompt in enumerate(prompts)
+                if (prompt.mask_logits is not None) == refine
+            ]
+            if not indices:
+                continue
+            group = [prompts[i] for i in indices]
+            point_coords, point_labels = get_point_prompts(group)
+            masks, scores, logits = self.predictor_.predict(
+                point_coords,
+                point_labels,
+                mask_input=(
+                    np.stack([prompt.mask_logits for prompt in group])[:, None]
+                    if refine
+                    else None
+                ),
+                multimask_output=not refine,
+            )
+            # The prompt dimension is squeezed out for a single prompt
+            masks = masks.reshape((len(group), -1) + masks.shape[-2:])
+            scores = scores.reshape((len(group), -1))
+            logits = logits.reshape((len(group), -1) + logits.shape[-2:])
+            for i, prompt_masks, prompt_scores, prompt_logits in zip(
+                indices, masks, scores, logits
+            ):
+                best = np.argmax(prompt_scores)
+                results[i] = (prompt_masks[best], prompt_logits[best])
+        return [results[i] for i in range(len(prompts))]
+
+    def process_batch(
+        self,
+        images: list[np.ndarray],
+        prompts: list[list[Prompt]],
+        image_keys: list[tuple[str, int] | None] | None = None,
+    ) -> list[list[tuple[np.ndarray, np.ndarray]]]:
+        # The best mask and its logits for every prompt of every image
+        if image_keys is None:
+            image_keys = [None] * len(images)
+        embeddings = self.get_embeddings(images, image_keys)
+        return [
+            self.predict_masks(embedding, image_prompts) if image_prompts else []
+            for embedding, image_prompts in zip(embeddings, prompts)
+        ]
+
     def process_click(
-        self, image: np.ndarray, positive: np.ndarray, negative: np.ndarray
+        self,
+        image: np.ndarray,
+        positive: np.ndarray,
+        negative: np.ndarray,
+        image_key: tuple[str, int] | None = None,
     ) -> np.ndarray:
-        self.predictor_.set_image(image)
+        prompt = Prompt(positive, negative)
+        return self.process_batch([image], [[prompt]], [image_key])[0][0][0]
 
-        point_coords = np.concatenate([positive, negative])
-        point_labels = np.zeros((positive.shape[0] + negative.shape[0]))
-        point_labels[0 : positive.shape[0]] = 1
 
-        masks, scores, _ = self.predictor_.predict(
-            point_coords,
-            point_labels,
-            multimask_output=True,
-        )
-        sorted_ind = np.argsort(scores)[::-1]
-        masks = masks[sorted_ind]
-        return masks[0]
+def get_point_prompts(prompts: list[Prompt]) -> tuple[np.ndarray, np.ndarray]:
+    # Point coordinates [prompt, point, xy] and labels [prompt, point]. Shorter
+    # prompts are padded with label -1, the not-a-point label of SAM2.
+    point_count = max(len(p.positive) + len(p.negative) for p in prompts)
+    point_coords = np.zeros((len(prompts), point_count, 2))
+    point_labels = np.full((len(prompts), point_count), -1)
+    for i, prompt in enumerate(prompts):
+        points = np.concatenate([prompt.positive, prompt.negative])
+        point_coords[i, : len(points)] = points
+        point_labels[i, : len(prompt.positive)] = 1
+        point_labels[i, len(prompt.positive) : len(points)] = 0
+    return point_coords, point_labels
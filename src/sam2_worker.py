@@ -0,0 +1,275 @@
+import multiprocessing
+import queue
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import numpy as np
+
+# (positive points, negative points, low resolution logits or None)
+PromptData = tuple[np.ndarray, np.ndarray, np.ndarray | None]
+
+
+@dataclass
+class SharedFrame:
+    # A frame the GUI process copied into shared memory for the worker
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+    def read(self) -> np.ndarray:
+        # The GUI process owns the block and unlinks it. A spawned worker shares
+        # its resource tracker, attaching registers the block there again,
+        # which is harmless.
+        block = shared_memory.SharedMemory(name=self.name)
+        image = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf).copy()
+        block.close()
+        return image
+
+
+def share_frame(image: np.ndarray) -> tuple[SharedFrame, shared_memory.SharedMemory]:
+    block = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[:] = image
+    return SharedFrame(block.name, image.shape, image.dtype.str), block
+
+
+@dataclass
+class SegmentRequest:
+    frames: list[SharedFrame]
+    prompts: list[list[PromptData]]
+    image_keys: list[tuple[str, int] | None]
+
+
+@dataclass
+class PropagateRequest:
+    # Starts tracking, the worker pauses after chunk_size frames
+    video_path: Path
+    frame_index: int
+    prompts: dict[str, tuple[np.ndarray, np.ndarray]]
+    frame_count: int
+    chunk_size: int
+
+
+@dataclass
+class ContinuePropagateRequest:
+    chunk_size: int
+
+
+@dataclass
+class CancelPropagateRequest:
+    pass
+
+
+def send_propagated(
+    propagation: Iterator, chunk_size: int, results: multiprocessing.Queue
+) -> bool:
+    # Sends up to chunk_size frames, False once the propagation is exhausted
+    for _ in range(chunk_size):
+        frame = next(propagation, None)
+        if frame is None:
+            results.put(("done",))
+            return False
+        results.put(("propagated", *frame))
+    results.put(("paused",))
+    return True
+
+
+def run_sam2_worker(
+    requests: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    sam2_options: dict[str, Any],
+) -> None:
+    # Worker process main loop. Results are tuples tagged with their kind:
+    # ("status", message), ("loaded", device type), ("masks", masks per frame),
+    # ("propagated", frame index, image, masks), ("paused",), ("done",) and
+    # ("error", message). A paused propagation keeps its state between
+    # requests, so segment requests can run in between.
+    processor = None
+    propagator = None
+    propagation: Iterator | None = None
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        if isinstance(request, CancelPropagateRequest):
+            # Not answered, the caller does not wait for it
+            if propagation is not None:
+                propagation.close()
+                propagation = None
+            continue
+
+        if processor is None:
+            results.put(("status", "sam2:Loading model"))
+            try:
+                # Imported here, torch and sam2 alone take seconds to import
+                from sam2_processor import Sam2Processor
+
+                processor = Sam2Processor(**sam2_options)
+                results.put(("loaded", processor.device_.type))
+            except Exception as e:
+                # No masks for the request, its records stay unsegmented and
+                # the next request tries to load the model again
+                print(f"Failed to load the sam2 model: {e}")
+                results.put(("status", "sam2:Model failed to load"))
+                results.put(
+                    ("error", f"Model failed to load: {type(e).__name__}: {e}")
+                )
+                continue
+
+        try:
+            if isinstance(request, SegmentRequest):
+                images = [frame.read() for frame in request.frames]
+                from sam2_processor import Prompt
+
+                masks = processor.process_batch(
+                    images,
+                    [
+                        [Prompt(*prompt) for prompt in image_prompts]
+                        for image_prompts in request.prompts
+                    ],
+                    request.image_keys,
+                )
+                # Binary masks are a quarter of the size to send back
+                masks = [
+                    [(mask.astype(np.uint8), logits) for mask, logits in frame_masks]
+                    for frame_masks in masks
+                ]
+                results.put(("masks", masks))
+
+            elif isinstance(request, PropagateRequest):
+                if propagation is not None:
+                    propagation.close()
+                    propagation = None
+                if propagator is None:
+                    results.put(("status", "sam2:Loading video model"))
+                    from mask_propagator import MaskPropagator
+
+                    propagator = MaskPropagator(
+                        processor.device_,
+                        processor.model_,
+                        processor.checkpoint_dir_,
+                    )
+                propagation = propagator.propagate(
+                    request.video_path,
+                    request.frame_index,
+                    request.prompts,
+                    request.frame_count,
+                )
+                if not send_propagated(propagation, request.chunk_size, results):
+                    propagation = None
+
+            elif isinstance(request, ContinuePropagateRequest):
+                if propagation is None:
+                    results.put(("done",))
+                elif not send_propagated(propagation, request.chunk_size, results):
+                    propagation = None
+        except Exception as e:
+            # Ends the request, the worker carries on with the next one
+            if propagation is not None and not isinstance(request, SegmentRequest):
+                propagation.close()
+                propagation = None
+            results.put(("error", f"{type(e).__name__}: {e}"))
+
+
+class Sam2Worker:
+    # Runs SAM2 in a child process, so inference never competes with the GUI
+    # for the GIL. Frames go through shared memory, the rest through queues.
+    # Calls block the calling thread until the worker answers.
+    def __init__(
+        self, sam2_options: dict[str, Any], on_status: Callable[[str], None]
+    ) -> None:
+        context = multiprocessing.get_context("spawn")
+        self.requests_ = context.Queue()
+        self.results_ = context.Queue()
+        self.on_status = on_status
+        self.device_type: str | None = None  # Known once the model is loaded
+        self.propagating = False  # A propagation is paused between chunks
+        self.process_ = context.Process(
+            target=run_sam2_worker,
+            args=(self.requests_, self.results_, sam2_options),
+            daemon=True,
+        )
+        self.process_.start()
+
+    def get_result(self) -> tuple:
+        # Next result other than a status update, raises the errors of the worker
+        while True:
+            try:
+                result = self.results_.get(timeout=1.0)
+            except queue.Empty:
+                if not self.is_alive():
+                    raise RuntimeError("The sam2 worker process stopped")
+                continue
+            if result[0] == "status":
+                self.on_status(result[1])
+            elif result[0] == "loaded":
+                self.device_type = result[1]
+            elif result[0] == "error":
+                raise RuntimeError(result[1])
+            else:
+                return result
+
+    def segment(
+        self,
+        images: list[np.ndarray],
+        prompts: list[list[PromptData]],
+        image_keys: list[tuple[str, int] | None],
+    ) -> list[list[tuple[np.ndarray, np.ndarray | None]]]:
+        # The best mask and its logits for every prompt of every image
+        shared = [share_frame(image) for image in images]
+        try:
+            self.requests_.put(
+                SegmentRequest([frame for frame, _ in shared], prompts, image_keys)
+            )
+            return self.get_result()[1]
+        finally:
+            for _, block in shared:
+                block.close()
+                block.unlink()
+
+    def propagate(
+        self,
+        video_path: Path,
+        frame_index: int,
+        prompts: dict[str, tuple[np.ndarray, np.ndarray]],
+        frame_count: int,
+        chunk_size: int,
+    ) -> Iterator[tuple[int, np.ndarray, dict[str, np.ndarray]]]:
+        # See MaskPropagator.propagate. Yields the first chunk_size frames,
+        # then propagating tells if continue_propagation has more. The
+        # generator must be exhausted, the worker streams the whole chunk.
+        self.propagating = False
+        self.requests_.put(
+            PropagateRequest(video_path, frame_index, prompts, frame_count, chunk_size)
+        )
+        yield from self.get_propagated()
+
+    def continue_propagation(
+        self, chunk_size: int
+    ) -> Iterator[tuple[int, np.ndarray, dict[str, np.ndarray]]]:
+        self.propagating = False
+        self.requests_.put(ContinuePropagateRequest(chunk_size))
+        yield from self.get_propagated()
+
+    def cancel_propagation(self) -> None:
+        self.propagating = False
+        self.requests_.put(CancelPropagateRequest())
+
+    def get_propagated(self) -> Iterator[tuple[int, np.ndarray, dict[str, np.ndarray]]]:
+        while True:
+            result = self.get_result()
+            if result[0] in ("paused", "done"):
+                self.propagating = result[0] == "paused"
+                return
+            yield result[1], result[2], result[3]
+
+    def is_alive(self) -> bool:
+        return self.process_.is_alive()
+
+    def stop(self) -> None:
+        self.requests_.put(None)
+        self.process_.join(timeout=5)
+        if self.process_.is_alive():
+            self.process_.terminate()
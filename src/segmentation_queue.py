@@ -0,0 +1,79 @@
+import threading
+import time
+from queue import Empty
+
+
+class SegmentationQueue:
+    # Frames waiting for segmentation, shared by the UI and the segmenter
+    # thread. A frame is queued at most once, however often it is put, and the
+    # frame on screen is handed out before the others, which go in order.
+    def __init__(self) -> None:
+        self.condition_ = threading.Condition()
+        self.pending_: dict[int, None] = {}  # Ordered set
+        self.current_frame_: int | None = None
+        # Mask propagation requests, frame index -> frames in each direction
+        self.propagations_: dict[int, int] = {}
+        # Set by clear(), the propagation in progress is stopped
+        self.cancel_propagation_ = False
+
+    def put(self, frame_index: int) -> None:
+        with self.condition_:
+            self.pending_[frame_index] = None
+            self.condition_.notify()
+
+    def set_current_frame(self, frame_index: int | None) -> None:
+        with self.condition_:
+            self.current_frame_ = frame_index
+
+    def has_current_frame(self) -> bool:
+        # The frame on screen waits for segmentation
+        with self.condition_:
+            return self.current_frame_ in self.pending_
+
+    def get(self, block: bool = True, timeout: float | None = None) -> int:
+        # Raises queue.Empty like queue.SimpleQueue.get
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition_:
+            while not self.pending_:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Empty
+                self.condition_.wait(remaining)
+
+            if self.current_frame_ in self.pending_:
+                frame_index = self.current_frame_
+            else:
+                frame_index = next(iter(self.pending_))
+            del self.pending_[frame_index]
+            return frame_index
+
+    def put_propagation(self, frame_index: int, frame_count: int) -> None:
+        with self.condition_:
+            self.propagations_[frame_index] = frame_count
+
+    def get_propagation(self) -> tuple[int, int] | None:
+        # Oldest propagation request, if any
+        with self.condition_:
+            if not self.propagations_:
+                return None
+            frame_index = next(iter(self.propagations_))
+            return frame_index, self.propagations_.pop(frame_index)
+
+    def take_cancel_propagation(self) -> bool:
+        with self.condition_:
+            cancel = self.cancel_propagation_
+            self.cancel_propagation_ = False
+            return cancel
+
+    def clear(self) -> None:
+        with self.condition_:
+            self.pending_.clear()
+            self.propagations_.clear()
+            self.cancel_propagation_ = True
+
+    def qsize(self) -> int:
+        with self.condition_:
+            return len(self.pending_)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
@@ -2,10 +2,11 @@ from dataclasses import asdict
 import os
 import json
 from database import active_db, Database, DatabaseFrame, Record
+from frame_cache import shared_frame_cache
 from pathlib import Path
-import cv2
 from typing import Any
 import numpy as np
+from video_source import VideoSource
 
 
 def get_db_serialization_path(video_path: Path) -> Path:
@@ -27,9 +28,14 @@ def get_fields(a: object, fields: list[str]) -> dict[str, Any]:
 
 def serialize_database() -> None:
     json_path = get_db_serialization_path(active_db().video_path)
-    with json_path.open("w") as f:
-        json.dump(
-            [
+    data = []
+    for frame in active_db().frames.values():
+        # Propagated masks are not saved, they can be propagated again
+        records = [
+            record for record in frame.records.values() if record.derived_from is None
+        ]
+        if records:
+            data.append(
                 {
                     "frame": frame.frame,
                     "records": [
@@ -38,19 +44,17 @@ def serialize_database() -> None:
                             "ppoints": record.positive_points.tolist(),
                             "npoints": record.negative_points.tolist(),
                         }
-                        for record in frame.records.values()
+                        for record in records
                     ],
                 }
-                for frame in active_db().frames.values()
-            ],
-            f,
-            indent=2,
-        )
+            )
+    with json_path.open("w") as f:
+        json.dump(data, f, indent=2)
     print(f"Saved points to {str(json_path)}")
     active_db().is_dirty = False
 
 
-def deserialize_database(video_path: Path, video_reader: cv2.VideoCapture) -> Database:
+def deserialize_database(video_path: Path, video_source: VideoSource) -> Database:
     db = Database(video_path=video_path)
 
     json_path = get_db_serialization_path(video_path)
@@ -59,6 +63,18 @@ def deserialize_database(video_path: Path, video_reader: cv2.VideoCapture) -> Da
             with json_path.open("r") as f:
                 data = json.load(f)
 
+            # Decode the annotated frames that are not cached in one batch,
+            # in video order
+            frame_cache = shared_frame_cache()
+            images = {}
+            for frame_index in sorted(fdata["frame"] for fdata in data):
+                images[frame_index] = frame_cache.get(video_path, frame_index)
+            missing = [index for index, image in images.items() if image is None]
+            for frame_index, image in video_source.read_batch(missing):
+                images[frame_index] = image
+                if image is not None:
+                    frame_cache.put(video_path, frame_index, image)
+
             for fdata in data:
                 frame_index: int = fdata["frame"]
                 records = {
@@ -71,8 +87,7 @@ def deserialize_database(video_path: Path, video_reader: cv2.VideoCapture) -> Da
                     for rdata in fdata["records"]
                 }
 
-                video_reader.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-                _, image = video_reader.read()
+                image = images[frame_index]
 
                 db.frames[frame_index] = DatabaseFrame(
                     frame=frame_index, original_image=image, records=records
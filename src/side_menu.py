@@ -1,7 +1,6 @@
 import json
 import sys
 from pathlib import Path
-from queue import SimpleQueue
 
 import PySide6.QtWidgets as QtWidgets
 from PySide6.QtWidgets import (
@@ -16,11 +15,12 @@ from PySide6.QtWidgets import (
 )
 
 from database import active_db, Record
+from segmentation_queue import SegmentationQueue
 from serialization import serialize_database
 
 
 class SideMenu(QWidget):
-    def __init__(self, slider, work_queue: SimpleQueue):
+    def __init__(self, slider, work_queue: SegmentationQueue):
         super().__init__()
 
         self.slider = slider
@@ -96,9 +96,11 @@ class SideMenu(QWidget):
                 item_layout = QHBoxLayout()
 
                 # Display the record info
-                label = QLabel(
-                    f"{record.name} at {record.frame} +{record.positive_points.shape[0]} -{record.negative_points.shape[0]}"
-                )
+                if record.derived_from is None:
+                    text = f"{record.name} at {record.frame} +{record.positive_points.shape[0]} -{record.negative_points.shape[0]}"
+                else:
+                    text = f"{record.name} at {record.frame} (from {record.derived_from})"
+                label = QLabel(text)
                 item_layout.addWidget(label)
 
                 # Add a "Delete" button for each record
@@ -1,3 +1,23 @@
+import logging
+from pathlib import Path
+from typing import Any
+
+import cv2
+
+
+def get_video_key(video_path: Path) -> dict[str, Any]:
+    # Identifies the file the cached index, scores and proxy were built from
+    stat = video_path.stat()
+    return {"video_size": stat.st_size, "video_mtime_ns": stat.st_mtime_ns}
+
+
+def init_batch_worker(opencv_threads: int = 1) -> None:
+    # Process pool initializer. Each worker already owns a core, OpenCV's own
+    # thread pool would only oversubscribe the machine.
+    cv2.setNumThreads(opencv_threads)
+    logging.basicConfig(level=logging.WARNING)
+
+
 def pretty_time_delta(seconds: float, seconds_fmt: str = "%.1f") -> str:
     sign_string = "-" if seconds < 0 else ""
 
@@ -0,0 +1,98 @@
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils import get_video_key
+
+
+def get_index_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".index.npz")
+
+
+@dataclass
+class VideoIndex:
+    # Keyframes and presentation timestamps of a video, from one demux pass
+    keyframes: np.ndarray  # Sorted frame indices, starts with 0
+    timestamps_ms: np.ndarray  # Per frame, in presentation order
+
+    def get_keyframe(self, index: int) -> int:
+        # Keyframe a seek to index restarts decoding from
+        position = np.searchsorted(self.keyframes, index, side="right") - 1
+        return int(self.keyframes[max(position, 0)])
+
+    def get_keyframe_interval(self) -> int | None:
+        # Largest GOP, None with a single keyframe
+        if len(self.keyframes) < 2:
+            return None
+        return int(np.diff(self.keyframes).max())
+
+    def get_time(self, index: int, fps: float) -> float:
+        # Seconds, exact for variable frame rate videos
+        if 0 <= index < len(self.timestamps_ms):
+            return float(self.timestamps_ms[index]) / 1000
+        return index / fps
+
+
+def build_video_index(
+    video_path: Path, max_packets: int | None = None
+) -> VideoIndex:
+    # Demux packets without decoding them (raw mode). Packets come in decode
+    # order, the timestamps are sorted back into presentation order. With
+    # closed GOPs a keyframe packet index is also its frame index. With
+    # max_packets only the start of the video is indexed.
+    reader = cv2.VideoCapture(
+        str(video_path), cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1]
+    )
+    keyframes = []
+    timestamps_ms = []
+    if reader.isOpened():
+        while (
+            max_packets is None or len(timestamps_ms) < max_packets
+        ) and reader.grab():
+            if reader.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(len(timestamps_ms))
+            timestamps_ms.append(reader.get(cv2.CAP_PROP_POS_MSEC))
+    reader.release()
+
+    if not keyframes or keyframes[0] != 0:
+        # Decoding always starts at the first frame
+        keyframes.insert(0, 0)
+    return VideoIndex(
+        keyframes=np.array(keyframes, dtype=np.int64),
+        timestamps_ms=np.sort(np.array(timestamps_ms, dtype=np.float64)),
+    )
+
+
+def load_video_index(video_path: Path) -> VideoIndex:
+    # Built on the first load of a video, then read from the file next to it
+    index_path = get_index_path(video_path)
+    key = get_video_key(video_path)
+    if index_path.exists():
+        try:
+            with np.load(index_path) as data:
+                if json.loads(str(data["key"])) == key:
+                    return VideoIndex(
+                        keyframes=data["keyframes"],
+                        timestamps_ms=data["timestamps_ms"],
+                    )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Failed to read {str(index_path)}: {e}")
+
+    video_index = build_video_index(video_path)
+    tmp_path = index_path.with_name(index_path.name + ".tmp.npz")
+    try:
+        np.savez(
+            tmp_path,
+            keyframes=video_index.keyframes,
+            timestamps_ms=video_index.timestamps_ms,
+            key=json.dumps(key),
+        )
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # A read-only folder only costs the demux pass on the next load
+        print(f"Failed to write {str(index_path)}: {e}")
+    return video_index
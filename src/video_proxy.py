@@ -0,0 +1,135 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, TextIO
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from motion_checkpoint import write_json_atomic
+from utils import get_video_key, init_batch_worker
+from video_index import load_video_index
+from video_source import choose_decode_mode, open_video_source
+
+# Scrubbing proxies: thumbnails of a video at a fixed stride, in a memory
+# mapped .npy array next to it. The viewer shows them while the slider is
+# dragged instead of decoding full resolution frames.
+
+
+def get_proxy_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".proxy.npy")
+
+
+def get_proxy_info_path(video_path: Path) -> Path:
+    return video_path.with_suffix(".proxy.json")
+
+
+class VideoProxy:
+    def __init__(self, thumbnails: np.ndarray, stride: int) -> None:
+        self.thumbnails = thumbnails  # [thumbnail, H, W, 3] BGR, memory mapped
+        self.stride = stride  # Frames between two thumbnails
+
+    def get(self, frame_index: int) -> np.ndarray:
+        # Thumbnail nearest to the frame
+        index = min(round(frame_index / self.stride), len(self.thumbnails) - 1)
+        return self.thumbnails[max(index, 0)]
+
+
+def load_video_proxy(video_path: Path) -> VideoProxy | None:
+    # None if the proxy was not generated or the video changed since
+    info_path = get_proxy_info_path(video_path)
+    proxy_path = get_proxy_path(video_path)
+    if not info_path.exists() or not proxy_path.exists():
+        return None
+    try:
+        with info_path.open("r") as f:
+            info = json.load(f)
+        if info["key"] != get_video_key(video_path):
+            return None
+        thumbnails = np.load(proxy_path, mmap_mode="r")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Failed to load the proxy of {str(video_path)}: {e}")
+        return None
+    if len(thumbnails) == 0:
+        return None
+    return VideoProxy(thumbnails, info["stride"])
+
+
+def generate_proxy(
+    video_path: Path,
+    width: int = 320,
+    step_sec: float = 0.25,
+    progress_callback: Callable[[int], None] | None = None,
+) -> None:
+    video_source = open_video_source(video_path)
+    try:
+        if video_source.frame_count <= 0:
+            raise RuntimeError("Failed to read the video")
+        stride = max(round(video_source.fps * step_sec), 1)
+        height = max(round(width * video_source.height / max(video_source.width, 1)), 1)
+        indices = list(range(0, video_source.frame_count, stride))
+
+        # Also caches the keyframe index for the viewer
+        keyframe_interval = load_video_index(video_path).get_keyframe_interval()
+        decode_mode = choose_decode_mode(stride, keyframe_interval)
+
+        proxy_path = get_proxy_path(video_path)
+        tmp_path = proxy_path.with_name(proxy_path.name + ".tmp.npy")
+        thumbnails = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.uint8, shape=(len(indices), height, width, 3)
+        )
+        previous = None
+        for i, (_, frame) in enumerate(video_source.read_batch(indices, decode_mode)):
+            if frame is not None:
+                thumbnails[i] = cv2.resize(
+                    frame, (width, height), interpolation=cv2.INTER_AREA
+                )
+                previous = thumbnails[i]
+            elif previous is not None:
+                # An unreadable frame repeats the previous thumbnail
+                thumbnails[i] = previous
+            if progress_callback is not None:
+                progress_callback(1)
+        thumbnails.flush()
+        del thumbnails
+    finally:
+        video_source.release()
+
+    os.replace(tmp_path, proxy_path)
+    write_json_atomic(
+        get_proxy_info_path(video_path),
+        {"stride": stride, "width": width, "key": get_video_key(video_path)},
+    )
+
+
+def generate_proxies_batch(
+    video_files: list[Path],
+    workers: int | None = None,
+    progress_file: TextIO | None = None,
+    **proxy_kwargs,
+) -> dict[Path, str]:
+    # Returns the errors by video
+    workers = workers or os.cpu_count() or 1
+    errors = {}
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=mp_context, initializer=init_batch_worker
+    ) as executor, tqdm(
+        total=len(video_files), file=progress_file, desc="Proxies"
+    ) as progress_bar:
+        pending = {
+            executor.submit(generate_proxy, video_file, **proxy_kwargs): video_file
+            for video_file in video_files
+        }
+        for future in as_completed(pending):
+            video_file = pending[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Proxy generation failed for {str(video_file)}: {e}")
+                errors[video_file] = str(e)
+            progress_bar.update(1)
+    return errors
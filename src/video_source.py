@@ -0,0 +1,202 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import cv2
+import numpy as np
+
+from frame_cache import FrameCache
+from video_index import VideoIndex, build_video_index
+
+VIDEO_BACKENDS = ("opencv", "decord")
+DECODE_MODES = ("auto", "seek", "sequential")
+
+
+def estimate_keyframe_interval(video_path: Path, max_packets: int = 1000) -> int | None:
+    # Keyframe spacing at the start of the video, from demuxed packets only
+    return build_video_index(video_path, max_packets).get_keyframe_interval()
+
+
+def choose_decode_mode(frame_step: int, keyframe_interval: int | None) -> str:
+    # A seek restarts decoding at the previous keyframe, so on average it decodes
+    # half a GOP plus the cost of flushing the decoder. Streaming decodes every
+    # frame between two samples, so it wins as long as samples are closer than
+    # a GOP apart.
+    if keyframe_interval is None:
+        return "seek"
+    return "sequential" if frame_step <= keyframe_interval else "seek"
+
+
+class VideoSource(ABC):
+    # Random and batched access to the BGR frames of a video file
+    def __init__(self, video_path: Path) -> None:
+        self.video_path = video_path
+        self.frame_count = 0
+        self.fps = 0.0
+        self.width = 0
+        self.height = 0
+        self.decoded_frames = 0
+
+    @abstractmethod
+    def read(self, index: int) -> np.ndarray | None:
+        pass
+
+    def read_batch(
+        self, indices: Iterable[int], decode_mode: str = "seek"
+    ) -> Iterator[tuple[int, np.ndarray | None]]:
+        # Yields (index, frame) in the order requested, frame is None on errors
+        for index in indices:
+            yield index, self.read(index)
+
+    def release(self) -> None:
+        pass
+
+
+class OpenCvVideoSource(VideoSource):
+    def __init__(self, video_path: Path) -> None:
+        super().__init__(video_path)
+        self.video_reader_ = cv2.VideoCapture(str(video_path))
+        self.frame_count = int(self.video_reader_.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.video_reader_.get(cv2.CAP_PROP_FPS)
+        self.width = int(self.video_reader_.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.video_reader_.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.position_ = 0  # Index of the frame the next read() returns
+
+    def seek(self, index: int) -> None:
+        self.video_reader_.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.position_ = index
+
+    def read(self, index: int) -> np.ndarray | None:
+        # Reading the next frame needs no seek, which keeps playback cheap
+        if index != self.position_:
+            self.video_reader_.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = self.video_reader_.read()
+        self.position_ = index + 1
+        self.decoded_frames += 1
+        return frame if ret else None
+
+    def read_batch(
+        self, indices: Iterable[int], decode_mode: str = "seek"
+    ) -> Iterator[tuple[int, np.ndarray | None]]:
+        # Seeks decode from the previous keyframe internally, those frames are
+        # not counted in decoded_frames
+        for index in indices:
+            if decode_mode == "sequential" and index >= self.position_:
+                # Decode the frames in between without converting them
+                ok = True
+                while ok and self.position_ < index:
+                    ok = self.video_reader_.grab()
+                    self.position_ += 1
+                    self.decoded_frames += 1
+                ok = ok and self.video_reader_.grab()
+                frame = self.video_reader_.retrieve()[1] if ok else None
+                self.position_ = index + 1
+                self.decoded_frames += 1
+                yield index, frame
+            else:
+                yield index, self.read(index)
+
+    def release(self) -> None:
+        self.video_reader_.release()
+
+
+class DecordVideoSource(VideoSource):
+    def __init__(self, video_path: Path, batch_size: int = 16) -> None:
+        super().__init__(video_path)
+        # Imported here so the OpenCV backend works without decord installed
+        import decord
+
+        self.video_reader_ = decord.VideoReader(str(video_path), ctx=decord.cpu(0))
+        self.batch_size = batch_size
+        self.frame_count = len(self.video_reader_)
+        self.fps = self.video_reader_.get_avg_fps()
+        self.height, self.width = self.video_reader_[0].shape[0:2]
+
+    def read(self, index: int) -> np.ndarray | None:
+        try:
+            frame = self.video_reader_[index].asnumpy()
+        except Exception:
+            return None
+        self.decoded_frames += 1
+        # decord decodes to RGB, the rest of the app works in BGR
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+    def read_batch(
+        self, indices: Iterable[int], decode_mode: str = "seek"
+    ) -> Iterator[tuple[int, np.ndarray | None]]:
+        # get_batch plans the seeks for the whole batch in one call
+        indices = list(indices)
+        for start in range(0, len(indices), self.batch_size):
+            batch_indices = indices[start : start + self.batch_size]
+            try:
+                frames = self.video_reader_.get_batch(batch_indices).asnumpy()
+            except Exception:
+                # Fall back to single reads to find the bad frame
+                yield from super().read_batch(batch_indices)
+                continue
+            self.decoded_frames += len(batch_indices)
+            for index, frame in zip(batch_indices, frames):
+                yield index, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+
+class GopReader:
+    # Random access for scrubbing and reverse playback. A seek decodes from the
+    # previous keyframe anyway, so the frames up to the one asked for are kept
+    # in the frame cache: stepping back through a GOP decodes it once instead
+    # of once per frame. Only the frames on the grid of the playback step are
+    # kept, as far back as the GOP start or a quarter of the cache allow.
+    # Without a video index, while it is being built, frames are read with a
+    # plain seek.
+    def __init__(
+        self,
+        video_source: VideoSource,
+        video_index: VideoIndex | None,
+        frame_cache: FrameCache,
+    ) -> None:
+        self.video_source = video_source
+        self.video_index = video_index
+        self.frame_cache = frame_cache
+        frame_bytes = max(video_source.width * video_source.height * 3, 1)
+        self.max_frames = max(frame_cache.max_bytes // frame_bytes // 4, 1)
+
+    def read(self, index: int, step: int = 1) -> np.ndarray | None:
+        # step is the number of frames between two frames shown, reverse
+        # playback at -4x reads with step 4
+        video_path = self.video_source.video_path
+        frame = self.frame_cache.get(video_path, index)
+        if frame is not None:
+            return frame
+
+        video_index = self.video_index
+        if video_index is None or not isinstance(
+            self.video_source, OpenCvVideoSource
+        ):
+            # Backends with their own random access, or no index yet
+            frame = self.video_source.read(index)
+            if frame is not None:
+                self.frame_cache.put(video_path, index, frame)
+            return frame
+
+        # Continue from where the decoder is if it is already in this GOP
+        keyframe = video_index.get_keyframe(index)
+        start = self.video_source.position_
+        if not keyframe <= start <= index:
+            start = keyframe
+            self.video_source.seek(keyframe)
+        # The frames off the grid or before the window are grabbed without
+        # being kept
+        count = min((index - start) // step + 1, self.max_frames)
+        frame = None
+        for frame_index, frame in self.video_source.read_batch(
+            range(index - (count - 1) * step, index + 1, step), "sequential"
+        ):
+            if frame is not None:
+                self.frame_cache.put(video_path, frame_index, frame)
+        return frame
+
+
+def open_video_source(video_path: Path, backend: str = "opencv") -> VideoSource:
+    assert backend in VIDEO_BACKENDS
+    if backend == "decord":
+        return DecordVideoSource(video_path)
+    return OpenCvVideoSource(video_path)